@@ -5,11 +5,27 @@ from io import BytesIO
 import base64
 from mimetypes import guess_type
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from streamlit_webrtc import webrtc_streamer, WebRtcMode
 import wave
+import os
+import asyncio
 from datetime import datetime, date, time
-
-from utils.chatgpt_client import get_client, chat_completion
+from time import sleep
+
+from utils.chatgpt_client import get_client, get_async_client, chat_completion, chat_completion_stream
+from utils.key_pool import get_key_pool
+from utils.api_client import get_api_client
+from utils.bazi_prompts import (
+    PERSONAL_SECTION_GROUPS, build_personal_messages, build_pair_messages, format_birth, today_text
+)
+from utils.semantic_cache import SemanticCache, cached_chat_completion
+from utils.retrieval import DocumentIndex, document_hash
+from utils.report_fanout import personal_report_fanout
+from utils.pdf_generator import chat_sections, export_pdf_to_tempfile
+from utils.job_runner import JobRunner
+from utils.model_compare import compare_models, is_chat_model
+from utils.bazi_match import rank_candidates, relation_labels, pillar_text, parse_candidates
 
 # —— 页面配置 ——
 #    initial_sidebar_state="expanded"：桌面端默认展开
@@ -29,12 +45,96 @@ CATEGORY_RULES = OrderedDict([
     ("内容审核", lambda m: m.startswith("omni-moderation")),
     ("向量嵌入", lambda m: "embedding" in m),
     ("其他", None),
+    ("模型对比", None),
     ("八字运势", None),
 ])
 
+# 不对应具体模型、有独立页面的功能分类
+FEATURE_CATEGORIES = ("模型对比", "八字运势")
+
 def is_vision_model(mid: str) -> bool:
     return mid.startswith("gpt-4o") or mid.startswith("chatgpt-4o") or "vision" in mid
 
+
+def build_pdf_bytes(title: str, info_lines: list, sections) -> bytes:
+    # PDF 逐段排版写入临时文件，排版过程中不在内存里拼完整文档；
+    # 但 st.download_button 会把文件内容读入 Streamlit 的内存媒体存储，页面下载并非直接从磁盘发送，
+    # 需要从磁盘发送的场景请使用 server.py 的 /v1/pdf/export
+    pdf_path = export_pdf_to_tempfile(title, info_lines, sections)
+    try:
+        with open(pdf_path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(pdf_path)
+
+
+def offer_pdf_download(title: str, info_lines: list, sections, file_name: str, key: str):
+    st.download_button(
+        "导出 PDF", build_pdf_bytes(title, info_lines, sections),
+        file_name=file_name, mime="application/pdf", key=key
+    )
+
+
+def offer_job_pdf(job, sections, key: str):
+    """
+    已完成任务的 PDF 下载：只在第一次展示时排版一次并存入 job.meta，之后的页面重跑直接复用。
+    """
+    if "pdf" not in job.meta:
+        with st.spinner("正在生成 PDF…"):
+            job.meta["pdf"] = build_pdf_bytes(job.meta["title"], job.meta["info_lines"], sections)
+    st.download_button("导出 PDF", job.meta["pdf"], file_name=job.meta["file_name"], mime="application/pdf", key=key)
+
+
+@st.cache_resource
+def get_job_runner() -> JobRunner:
+    # 进程级共享：耗时生成放到后台线程池，页面重跑不会中断，重跑后凭会话中的任务 ID 重新取回。
+    # 线程池为所有会话共用，同时进行的任务数超过 JOB_WORKERS 时后来的任务排队；
+    # 分段报告、多人筛选等任务在运行期间一直占用一个线程（内部并发请求另有线程池）
+    return JobRunner(
+        max_workers=int(os.getenv("JOB_WORKERS", "64")),
+        ttl=float(os.getenv("JOB_TTL", "1800"))
+    )
+
+
+def current_job(slot: str):
+    """
+    取回会话中 slot 对应的后台任务；任务不存在或已过期时清除记录并返回 None。
+    """
+    job = get_job_runner().get(st.session_state.jobs.get(slot))
+    if job is None:
+        st.session_state.jobs.pop(slot, None)
+    return job
+
+
+def follow_job(job, render, spinner_text: str = "生成中…"):
+    # 轮询后台任务并渲染已生成的部分；用户操作触发重跑时轮询被打断，任务仍在后台继续
+    if not job.done:
+        with st.spinner(spinner_text):
+            while not job.done:
+                render(job)
+                sleep(0.5)
+    render(job)
+    if job.status == "error":
+        st.error(f"⚠️ 生成失败：{job.error}")
+
+
+@st.cache_resource
+def get_cached_api_client(api_key: str):
+    # 按 Key 复用 HTTP 客户端及其连接池，避免每次页面重跑都新建一个
+    return get_api_client(api_key)
+
+
+@st.cache_resource
+def get_semantic_cache() -> SemanticCache:
+    # 进程级共享：所有会话共用同一份语义缓存，设置 SEMANTIC_CACHE_DIR 后持久化到磁盘
+    return SemanticCache(path=os.getenv("SEMANTIC_CACHE_DIR"))
+
+
+@st.cache_resource
+def get_document_index() -> DocumentIndex:
+    # 进程级共享：同一份 PDF（按内容哈希）只切分、Embedding 一次
+    return DocumentIndex()
+
 MODEL_INFO = {
     "gpt-4": "上下文窗口 8K，适合复杂对话。",
     "gpt-4-32k": "上下文窗口 32K，适合大文档分析。",
@@ -56,9 +156,14 @@ MODEL_INFO = {
 
 # —— 侧边栏：填写 API Key ——
 st.sidebar.title("配置")
-api_key = st.sidebar.text_input("OpenAI API Key", type="password", help="在此处粘贴你的 OpenAI API Key")
-
-if not api_key:
+key_pool = get_key_pool()
+api_key = st.sidebar.text_input(
+    "OpenAI API Key",
+    type="password",
+    help="在此处粘贴你的 OpenAI API Key" + ("；留空则使用服务端 Key 池" if key_pool else "")
+)
+
+if not api_key and not key_pool:
     # 主界面显示人性化提示（加粗、加大字号与颜色）
     st.markdown(
         """
@@ -83,8 +188,13 @@ if not api_key:
     st.sidebar.error("请输入 API Key 才能继续")
     st.stop()
 
-# 创建 ChatGPT 客户端
+# 创建 ChatGPT 客户端（未填写 Key 时使用服务端 Key 池）
 client = get_client(api_key)
+if not api_key:
+    with st.sidebar.expander(f"Key 池用量（{len(key_pool)} 个 Key）"):
+        st.dataframe(key_pool.stats(), hide_index=True)
+# 配置了 API_BASE_URL 时，聊天 / 八字 / 语音走 HTTP 服务，否则为 None 并直连 OpenAI
+api = get_cached_api_client(api_key)
 
 # —— 获取可用模型列表 ——
 all_models = sorted(m.id for m in client.models.list().data)
@@ -95,7 +205,7 @@ rule = CATEGORY_RULES[category]
 if rule:
     models = [m for m in all_models if rule(m)]
 else:
-    other_rules = [r for k, r in CATEGORY_RULES.items() if k not in ("八字运势", "其他") and r]
+    other_rules = [r for k, r in CATEGORY_RULES.items() if k not in FEATURE_CATEGORIES + ("其他",) and r]
     models = [m for m in all_models if not any(r(m) for r in other_rules)]
 if not models:
     st.sidebar.warning("此类别下无可用模型，已显示全部模型")
@@ -110,8 +220,8 @@ models.sort(key=lambda x: (
     4
 ))
 
-# —— 如果不是“八字运势”分类，显示模型下拉框，并添加“新建聊天”按钮 ——
-if category != "八字运势":
+# —— 如果不是“八字运势”/“模型对比”分类，显示模型下拉框，并添加“新建聊天”按钮 ——
+if category not in FEATURE_CATEGORIES:
     model = st.sidebar.selectbox("模型", models)
     st.sidebar.markdown(f"**特点**：{MODEL_INFO.get(model, '暂无说明。')}")
     # —— 新建聊天按钮：点击后清空会话状态，不用重新输入 API Key ——
@@ -119,6 +229,10 @@ if category != "八字运势":
         st.session_state.messages = []
         st.session_state.session_pdfs = []
         st.session_state.session_images = []
+        st.session_state.get("jobs", {}).pop("chat", None)
+elif category == "模型对比":
+    model = None
+    st.sidebar.markdown("**功能说明**：同一个提示并发发给多个模型，并排对比回答质量、首字耗时、总耗时与 token 用量。")
 else:
     model = None
     st.sidebar.markdown("**功能说明**：此处使用 ChatGPT 接口进行八字排盘、流年流月分析、幸运色/数字/方位推荐、桃花财运预测，以及两人星宿配对。")
@@ -130,6 +244,10 @@ if "session_pdfs" not in st.session_state:
     st.session_state.session_pdfs = []
 if "session_images" not in st.session_state:
     st.session_state.session_images = []
+if "jobs" not in st.session_state:
+    st.session_state.jobs = {}
+
+runner = get_job_runner()
 
 # 标题
 st.title("💬 ChatGPT API 平台 & 八字运势")
@@ -141,14 +259,15 @@ if category == "八字运势":
     st.header("🀄 八字运势 / 两人星宿配对 （基于 ChatGPT）")
     st.markdown(
         "- **个人运势查询**：输入“姓名、性别、出生公历日期与时辰”，模型会给出八字、大运、流年流月、五行分析、喜用神、幸运色数字方位、事业学业、感情桃花、健康风险、财运走势、六亲关系等，全部以 Markdown 格式输出。\n"
-        "- **两人星宿配对**：输入“姓名1、性别1、出生日期与时辰1；姓名2、性别2、出生日期与时辰2”，模型会给出双方八字、配对吉凶、化解建议，全部以 Markdown 格式输出。"
+        "- **两人星宿配对**：输入“姓名1、性别1、出生日期与时辰1；姓名2、性别2、出生日期与时辰2”，模型会给出双方八字、配对吉凶、化解建议，全部以 Markdown 格式输出。\n"
+        "- **多人合婚筛选**：输入一人与候选名单，先在本地按生肖、日支、日干的合冲刑害查表打分排序，只把前几名交给模型并发生成完整配对报告。"
     )
 
     # —— 当前日期，传给模型做“近期”基准 ——
-    today = datetime.now().strftime("%Y年%m月%d日")
+    today = today_text()
 
-    # —— 让用户选择：单人运势 or 两人配对 ——
-    mode = st.radio("请选择：", ["个人运势查询", "两人星宿配对"], index=0)
+    # —— 让用户选择：单人运势 / 两人配对 / 多人筛选 ——
+    mode = st.radio("请选择：", ["个人运势查询", "两人星宿配对", "多人合婚筛选"], index=0)
 
     # —— 允许在此分支选择调用的 ChatGPT 模型 ——
     astro_model = st.selectbox(
@@ -174,7 +293,12 @@ if category == "八字运势":
                 help="请选择出生性别（用于命理分析）"
             )
         with col2:
-            st.write("")
+            fanout = st.checkbox(
+                "分段并行生成",
+                value=True,
+                key="single_fanout",
+                help="各章节分组并发生成，速度更快且不会因篇幅过长被截断"
+            )
 
         col3, col4 = st.columns(2)
         with col3:
@@ -199,54 +323,62 @@ if category == "八字运势":
                 st.error("⚠️ 请完整填写：姓名、性别、出生日期与时辰")
             else:
                 birth_dt = datetime.combine(date_str, time_str)
-                birth_text = birth_dt.strftime("%Y年%m月%d日 %H时%M分")
-
-                # 系统提示：要求输出 Markdown 格式
-                system_prompt = (
-                    "你是一位经验丰富的中文命理师，擅长八字排盘、流年流月运势分析、五行格局、喜用神、"
-                    "幸运色/数字/方位推荐、事业学业、感情桃花、健康风险、财运走势、六亲关系以及化解或增益建议。"
-                    "请以 **Markdown** 格式输出以下内容：\n"
-                    "1. # 个人信息：确认用户姓名、性别、出生信息，用以报头。\n"
-                    "2. ## 八字：按天干地支列出“年柱、月柱、日柱、时柱”，并简要说明各柱间的相生相克。\n"
-                    "3. ## 大运：列出该用户从出生日开始的每十年一个大运节点，并解释各大运主要吉凶变化，至少列出前三个大运。\n"
-                    "4. ## 流年流月运势：\n"
-                    "   - 以“参考日期”做基准，给出**最近三年每年流年运势**要点（至少包含事业、财运、感情、健康）。\n"
-                    "   - 结合**最近一个月份**和**下一个两个月份**，给出流月运势，指出关键吉凶事件。\n"
-                    "5. ## 五行分析：说明八字中各五行的旺衰或缺失，并指出是否需要某个五行调和。\n"
-                    "6. ## 喜用神：根据五行格局，建议最合适的喜用神，并说明理由。\n"
-                    "7. ## 幸运色 / 幸运数字 / 幸运方位：根据缺失与调和需求，推荐具体颜色、数字和方位，并举例说明日常应用（如穿衣、摆件、家居布局）。\n"
-                    "8. ## 事业学业：结合八字与流年流月，详细描述事业或学业机遇与挑战，并给出可落地的行动建议。\n"
-                    "9. ## 感情桃花：说明当前感情/桃花运势趋势，结合流年流月给出择偶/交友建议，并提示重要吉日或时辰。\n"
-                    "10. ## 健康：指出需关注的健康风险（如五行过旺/过弱对身体影响），并给出调养方案（饮食、运动、作息等）。\n"
-                    "11. ## 财运：结合流年流月预测近期财运走势（正财 + 偏财），并给出理财/投资时机建议。\n"
-                    "12. ## 六亲关系：简要说明父母、配偶、子女等与八字五行的相生相克关系，并给出家庭沟通或相处建议。\n"
-                    "13. ## 结论与建议：最后做全局总结，语言要接地气，贴近生活。\n"
-                    "请使用 Markdown 的标题、列表、粗体等格式，整篇文字不少于 1000 字。"
-                )
-                user_prompt = (
-                    f"参考日期（今天）：**{today}**。\n\n"
-                    f"**用户信息**：姓名：**{name}**；性别：**{gender}**；出生：**{birth_text}**。\n\n"
-                    "请按照上述要求输出详细运势分析。"
-                )
-
-                with st.spinner("正在调用 ChatGPT 生成详细运势，请稍候……"):
-                    answer = chat_completion(
+                birth_text = format_birth(birth_dt)
+
+                meta = {
+                    "title": "个人八字运势报告",
+                    "info_lines": [f"生成日期：{today}", f"姓名：{name}    性别：{gender}    出生：{birth_text}"],
+                    "file_name": f"八字运势_{name}.pdf",
+                }
+                if fanout and not api:
+                    def run_fanout(job):
+                        for idx, section in personal_report_fanout(client, astro_model, name, gender, birth_text, today):
+                            job.set_section(idx, section)
+                        return [job.sections[i] for i in range(len(PERSONAL_SECTION_GROUPS))]
+
+                    st.session_state.jobs["single"] = runner.submit("bazi_fanout", run_fanout, meta=meta)
+                elif api:
+                    st.session_state.jobs["single"] = runner.submit_stream(
+                        "bazi", api.bazi_personal_stream,
+                        astro_model, name, gender, birth_dt.isoformat(), today, fanout=fanout, meta=meta
+                    )
+                else:
+                    st.session_state.jobs["single"] = runner.submit_stream(
+                        "bazi", chat_completion_stream,
                         client=client,
                         model=astro_model,
-                        messages=[
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": user_prompt}
-                        ],
+                        messages=build_personal_messages(name, gender, birth_text, today),
                         temperature=0.7,
-                        max_tokens=2048
+                        max_tokens=2048,
+                        meta=meta
                     )
 
-                # —— 渲染为 Markdown 输出 ——
-                st.subheader("📜 八字运势结果（Markdown 格式）")
-                st.markdown(answer)
+        # —— 渲染后台任务（重跑后自动接上进行中的任务）——
+        job = current_job("single")
+        if job:
+            st.subheader("📜 八字运势结果（Markdown 格式）")
+            if job.kind == "bazi_fanout":
+                # —— 先按章节顺序放好占位，哪一组先完成就先填入哪一组 ——
+                slots = [st.empty() for _ in PERSONAL_SECTION_GROUPS]
+
+                def render(j):
+                    for i, (slot, (group_name, _)) in enumerate(zip(slots, PERSONAL_SECTION_GROUPS)):
+                        if i in j.sections:
+                            slot.markdown(j.sections[i])
+                        elif not j.done:
+                            slot.info(f"⏳ 正在生成：{group_name}")
+
+                follow_job(job, render, "正在分段并行生成详细运势，请稍候……")
+                sections = job.result or []
+            else:
+                box = st.empty()
+                follow_job(job, lambda j: box.markdown(j.text), "正在调用 ChatGPT 生成详细运势，请稍候……")
+                sections = [job.result or ""]
+            if job.status == "done":
+                offer_job_pdf(job, (("", section) for section in sections), key="single_pdf")
 
     # ------------------- 两人星宿配对 -------------------
-    else:
+    elif mode == "两人星宿配对":
         st.markdown(f"**参考日期（今天）：{today}**")
         st.markdown("请分别输入两人的姓名、性别、出生日期与时辰：")
         col1, col2 = st.columns(2)
@@ -291,46 +423,280 @@ if category == "八字运势":
             else:
                 birth1 = datetime.combine(date1, time1)
                 birth2 = datetime.combine(date2, time2)
-                birth_text1 = birth1.strftime("%Y年%m月%d日 %H时%M分")
-                birth_text2 = birth2.strftime("%Y年%m月%d日 %H时%M分")
-
-                system_prompt_pair = (
-                    "你是一位资深的中文命理师，精通八字配对与星宿关系分析。"
-                    "请以 **Markdown** 格式输出以下内容：\n"
-                    "1. **个人简介**：重复列出双方姓名、性别、出生信息，以便报头。\n"
-                    "2. **八字排盘**：分别列出双方“年柱、月柱、日柱、时柱”（天干地支），并简要说明各柱五行旺衰。\n"
-                    "3. **星宿/生肖/天干地支配对**：详细分析两人五行相生相克、地支三合三会、天干合冲等关系，说明是否相合、相冲、相刑或相害，对双方感情或合作的影响。\n"
-                    "4. **大运与流年对比**：结合“参考日期”，分别给出双方当前与下一步大运节点，并对比大运与当前流年运势，说明两人何时最易相合或相冲。\n"
-                    "5. **配对吉凶评估**：根据八字和大运流年对比，给出整体配对吉凶结论，至少包含情感/婚姻层面与事业/合作层面两方面。\n"
-                    "6. **日常相处建议**：结合双方八字和五行特点，给出具体生活化建议（如“宜在阴历X月Y日举办婚礼”，或“佩戴金饰、红色摆件以化解冲煞”）。\n"
-                    "7. **化解或增益方法**：如果存在冲克或冲煞，说明可采用的化解方式（佩戴何种饰品、家中摆放何物、工作座位方位等）。\n"
-                    "8. **结论**：最后给出全局总结，语言生动接地气，条理清晰，字数不少于 800 字。\n"
-                )
-                user_prompt_pair = (
-                    f"参考日期（今天）：**{today}**。\n\n"
-                    f"**用户1**：姓名：**{name1}**；性别：**{gender1}**；出生：**{birth_text1}**。\n"
-                    f"**用户2**：姓名：**{name2}**；性别：**{gender2}**；出生：**{birth_text2}**。\n\n"
-                    "请根据上述要求，输出完整八字配对与星宿关系分析。"
-                )
-
-                with st.spinner("正在调用 ChatGPT 进行星宿配对，请稍候……"):
-                    answer_pair = chat_completion(
+                birth_text1 = format_birth(birth1)
+                birth_text2 = format_birth(birth2)
+
+                meta = {
+                    "title": "两人星宿配对报告",
+                    "info_lines": [
+                        f"生成日期：{today}",
+                        f"姓名：{name1}    性别：{gender1}    出生：{birth_text1}",
+                        f"姓名：{name2}    性别：{gender2}    出生：{birth_text2}",
+                    ],
+                    "file_name": f"星宿配对_{name1}_{name2}.pdf",
+                }
+                if api:
+                    st.session_state.jobs["pair"] = runner.submit_stream(
+                        "bazi_pair", api.bazi_pair_stream,
+                        astro_model,
+                        {"name": name1, "gender": gender1, "birth": birth1.isoformat()},
+                        {"name": name2, "gender": gender2, "birth": birth2.isoformat()},
+                        today,
+                        meta=meta
+                    )
+                else:
+                    st.session_state.jobs["pair"] = runner.submit_stream(
+                        "bazi_pair", chat_completion_stream,
                         client=client,
                         model=astro_model,
-                        messages=[
-                            {"role": "system", "content": system_prompt_pair},
-                            {"role": "user", "content": user_prompt_pair}
-                        ],
+                        messages=build_pair_messages(name1, gender1, birth_text1, name2, gender2, birth_text2, today),
                         temperature=0.7,
-                        max_tokens=2048
+                        max_tokens=2048,
+                        meta=meta
                     )
 
-                st.subheader("💞 两人星宿配对结果（Markdown 格式）")
-                st.markdown(answer_pair)
+        job = current_job("pair")
+        if job:
+            st.subheader("💞 两人星宿配对结果（Markdown 格式）")
+            box = st.empty()
+            follow_job(job, lambda j: box.markdown(j.text), "正在调用 ChatGPT 进行星宿配对，请稍候……")
+            if job.status == "done":
+                offer_job_pdf(job, [("", job.result)], key="pair_pdf")
+
+    # ------------------- 多人合婚筛选 -------------------
+    else:
+        st.markdown(f"**参考日期（今天）：{today}**")
+        col0, col1, col2, col3 = st.columns(4)
+        with col0:
+            name = st.text_input("姓名", key="match_name", help="例如：张三")
+        with col1:
+            gender = st.selectbox("性别", options=["男", "女"], key="match_gender")
+        with col2:
+            birth_date = st.date_input(
+                "出生日期",
+                min_value=date(1900, 1, 1),
+                max_value=date(2200, 12, 31),
+                value=date(2000, 1, 1),
+                key="match_date",
+                help="请选择公历出生日期（1900–2200 年）"
+            )
+        with col3:
+            birth_time = st.time_input(
+                "出生时辰",
+                value=time(0, 0),
+                key="match_time",
+                help="请选择出生时辰（24 小时制）"
+            )
+
+        candidate_text = st.text_area(
+            "候选名单",
+            key="match_candidates",
+            height=160,
+            placeholder="李四,女,2001-03-15 08:30\n王五,女,1999-11-02",
+            help="每行一人：姓名,性别,出生时间（YYYY-MM-DD HH:MM，时间可省略）"
+        )
+        candidate_file = st.file_uploader("或上传候选名单 CSV（格式同上）", type=["csv", "txt"], key="match_csv")
+        col4, col5 = st.columns(2)
+        with col4:
+            top_k = st.slider("生成完整报告的人数", min_value=1, max_value=10, value=3, key="match_top_k")
+        with col5:
+            show_n = st.slider("排名表显示人数", min_value=5, max_value=100, value=20, key="match_show_n")
+
+        if st.button("开始筛选"):
+            text = candidate_text
+            if candidate_file is not None:
+                text += "\n" + candidate_file.getvalue().decode("utf-8-sig", errors="ignore")
+            candidates, errors = parse_candidates(text)
+            if errors:
+                st.warning("以下行已跳过：\n\n" + "\n\n".join(errors[:20]))
+            if not name.strip():
+                st.error("⚠️ 请填写姓名")
+            elif not candidates:
+                st.error("⚠️ 候选名单为空")
+            else:
+                birth_dt = datetime.combine(birth_date, birth_time)
+                birth_text = format_birth(birth_dt)
+
+                # —— 本地查表排名：整个候选池一次向量化打分，不调用模型 ——
+                order, scores = rank_candidates(birth_dt, [c[2] for c in candidates])
+                ranking = [
+                    {
+                        "排名": rank,
+                        "姓名": candidates[i][0],
+                        "性别": candidates[i][1],
+                        "出生": format_birth(candidates[i][2]),
+                        "年柱 / 日柱": pillar_text(candidates[i][2]),
+                        "得分": float(scores[i]),
+                        "命中关系": "、".join(relation_labels(birth_dt, candidates[i][2])) or "—",
+                    }
+                    for rank, i in enumerate(order[:max(show_n, top_k)], start=1)
+                ]
+                top = ranking[:top_k]
+                top_candidates = [candidates[i] for i in order[:top_k]]
+
+                def run_match(job):
+                    # 只有前 top_k 名交给模型，并发生成完整配对报告，哪份先完成先显示
+                    def pair_report(candidate):
+                        other_name, other_gender, other_birth = candidate
+                        if api:
+                            return "".join(api.bazi_pair_stream(
+                                astro_model,
+                                {"name": name, "gender": gender, "birth": birth_dt.isoformat()},
+                                {"name": other_name, "gender": other_gender, "birth": other_birth.isoformat()},
+                                today
+                            ))
+                        return chat_completion(
+                            client, astro_model,
+                            build_pair_messages(
+                                name, gender, birth_text, other_name, other_gender, format_birth(other_birth), today
+                            ),
+                            temperature=0.7, max_tokens=2048
+                        )
+
+                    with ThreadPoolExecutor(max_workers=len(top_candidates)) as pool:
+                        futures = {pool.submit(pair_report, c): i for i, c in enumerate(top_candidates)}
+                        for future in as_completed(futures):
+                            # 单个候选失败只影响该候选，其余报告照常保留、照常导出
+                            try:
+                                job.set_section(futures[future], future.result())
+                            except Exception as exc:
+                                job.meta["failed"].append(futures[future])
+                                job.set_section(futures[future], f"⚠️ 配对报告生成失败：{exc}")
+                    return [job.sections[i] for i in range(len(top_candidates))]
+
+                meta = {
+                    "ranking": ranking[:show_n],
+                    "top": top,
+                    "title": "多人合婚筛选报告",
+                    "info_lines": [
+                        f"生成日期：{today}",
+                        f"姓名：{name}    性别：{gender}    出生：{birth_text}",
+                        f"候选人数：{len(candidates)}    完整报告：前 {len(top)} 名",
+                    ],
+                    "file_name": f"合婚筛选_{name}.pdf",
+                    "failed": [],
+                }
+                st.session_state.jobs["match"] = runner.submit("bazi_match", run_match, meta=meta)
+
+        job = current_job("match")
+        if job:
+            st.subheader("📊 本地查表排名")
+            st.dataframe(job.meta["ranking"], use_container_width=True, hide_index=True)
+            st.subheader("💞 前几名的完整配对报告")
+            slots = []
+            for i, row in enumerate(job.meta["top"]):
+                with st.expander(f"第 {i + 1} 名：{row['姓名']}（得分 {row['得分']:g}）", expanded=i == 0):
+                    slots.append(st.empty())
+
+            def render(j):
+                for i, slot in enumerate(slots):
+                    if i in j.meta["failed"]:
+                        slot.error(j.sections[i])
+                    elif i in j.sections:
+                        slot.markdown(j.sections[i])
+                    elif not j.done:
+                        slot.info("⏳ 正在生成配对报告")
+
+            follow_job(job, render, "正在并发生成前几名的配对报告，请稍候……")
+            if job.status == "done":
+                offer_job_pdf(
+                    job,
+                    [(f"{row['排名']}. {row['姓名']}", text) for row, text in zip(job.meta["top"], job.result)],
+                    key="match_pdf"
+                )
 
     # “八字运势” 分支结束后，跳过后续模型流程
     st.stop()
 
+# ====================================================
+# —— “模型对比” 功能分支 ——
+# ====================================================
+if category == "模型对比":
+    st.header("⚖️ 多模型并发对比")
+    chat_models = [m for m in all_models if is_chat_model(m)] or all_models
+    default_models = [m for m in ("chatgpt-4o-latest", "gpt-4", "gpt-3.5-turbo") if m in chat_models]
+    compare_list = st.multiselect("参与对比的模型", chat_models, default=default_models)
+
+    workload = st.radio("对比内容", ["自由提问", "八字个人运势"], horizontal=True)
+    if workload == "自由提问":
+        system_text = st.text_input("系统提示（可选）", key="compare_system")
+        user_text = st.text_area("提示", height=120, key="compare_prompt")
+        compare_messages = ([{"role": "system", "content": system_text}] if system_text.strip() else []) + [
+            {"role": "user", "content": user_text}
+        ]
+        ready = bool(user_text.strip())
+    else:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            c_name = st.text_input("姓名", key="compare_name", help="例如：张三")
+        with col2:
+            c_gender = st.selectbox("性别", options=["男", "女"], key="compare_gender")
+        with col3:
+            c_birth = st.date_input(
+                "出生日期",
+                min_value=date(1900, 1, 1),
+                max_value=date(2200, 12, 31),
+                value=date(2000, 1, 1),
+                key="compare_date"
+            )
+        c_time = st.time_input("出生时辰", value=time(0, 0), key="compare_time")
+        compare_messages = build_personal_messages(
+            c_name, c_gender, format_birth(datetime.combine(c_birth, c_time)), today_text()
+        )
+        ready = bool(c_name.strip())
+
+    if st.button("开始对比", disabled=not (ready and compare_list)):
+        models_to_run = list(compare_list)
+
+        def run_compare(job, messages: list):
+            async def main():
+                # 异步客户端在任务线程自己的事件循环里创建，各模型请求并发执行；
+                # 循环结束前关闭客户端（Key 池则关闭其在本循环中的客户端），不遗留连接池
+                async with get_async_client(api_key) as async_client:
+                    return await compare_models(
+                        async_client, models_to_run, messages,
+                        on_update=lambda r: job.set_section(models_to_run.index(r.model), r)
+                    )
+
+            return asyncio.run(main())
+
+        st.session_state.jobs["compare"] = runner.submit(
+            "compare", run_compare, compare_messages, meta={"models": models_to_run}
+        )
+
+    job = current_job("compare")
+    if job:
+        job_models = job.meta["models"]
+        cols = st.columns(len(job_models))
+        boxes = []
+        for col, m in zip(cols, job_models):
+            with col:
+                st.subheader(m)
+                boxes.append((st.empty(), st.empty()))
+
+        def render(j):
+            for i, (metrics_box, text_box) in enumerate(boxes):
+                r = j.sections.get(i)
+                if r is None:
+                    metrics_box.caption("⏳ 等待首字…")
+                    continue
+                if r.error is not None:
+                    metrics_box.error(f"⚠️ {r.error}")
+                    continue
+                stats = [f"首字 {r.ttft:.2f}s" if r.ttft is not None else "等待首字…"]
+                if r.done:
+                    stats.append(f"总耗时 {r.latency:.2f}s")
+                    if r.completion_tokens is not None:
+                        stats.append(f"输入 {r.prompt_tokens} / 输出 {r.completion_tokens} tokens")
+                    if r.tokens_per_second:
+                        stats.append(f"{r.tokens_per_second:.1f} tokens/s")
+                metrics_box.caption(" · ".join(stats))
+                text_box.markdown(r.text)
+
+        follow_job(job, render, "各模型并发生成中…")
+
+    st.stop()
+
 # ====================================================
 # —— 以下为原有：多模态 / 视觉、语音识别、语音合成、图像生成、代码模型、聊天 等逻辑 ——
 # ====================================================
@@ -341,10 +707,19 @@ if category != "语音识别":
         "上传 PDF(可选，多文件)", type=["pdf"], accept_multiple_files=True, key="pdf_uploader"
     )
     st.session_state.session_pdfs = list(pdfs) if pdfs else []
-    truncate_pdf = st.sidebar.checkbox("启用 PDF 截断", help="勾选后按字数截断")
+    use_retrieval = st.sidebar.checkbox("启用 PDF 检索模式", help="只把与问题最相关的片段发给模型，适合大文档")
+    truncate_pdf = False
     trunc_chars = None
-    if truncate_pdf:
-        trunc_chars = st.sidebar.number_input("截断字数", min_value=1, value=2000, step=100)
+    if use_retrieval:
+        retrieval_top_k = st.sidebar.number_input("检索片段数 (top-k)", min_value=1, max_value=20, value=5)
+    else:
+        truncate_pdf = st.sidebar.checkbox("启用 PDF 截断", help="勾选后按字数截断")
+        if truncate_pdf:
+            trunc_chars = st.sidebar.number_input("截断字数", min_value=1, value=2000, step=100)
+    use_semantic_cache = st.sidebar.checkbox("启用语义缓存", help="语义相近的纯文本提问直接复用已有回答（含附件时不缓存）")
+    cache_threshold = 0.92
+    if use_semantic_cache:
+        cache_threshold = st.sidebar.slider("缓存相似度阈值", min_value=0.80, max_value=0.99, value=0.92, step=0.01)
     if category == "多模态 / 视觉" and is_vision_model(model):
         imgs = st.sidebar.file_uploader(
             "上传 图片(多选)", type=["png", "jpg", "jpeg"], accept_multiple_files=True, key="img_uploader"
@@ -353,6 +728,8 @@ if category != "语音识别":
     else:
         st.session_state.session_images = []
 else:
+    use_semantic_cache = False
+    use_retrieval = False
     st.session_state.session_pdfs = []
     st.session_state.session_images = []
 
@@ -386,28 +763,35 @@ if category == "代码模型":
     code_request = st.chat_input("输入代码请求…")
 
 # —— 主逻辑分支 ——
-if category == "图像生成" and image_prompt:
-    if st.sidebar.button("生成图片", key="gen_img_btn"):
-        with st.spinner("生成中…"):
-            r = client.images.generate(
-                prompt=image_prompt,
-                model=model if model.startswith("dall") else None,
-                n=1
-            )
-        st.image(r.data[0].url)
+if category == "图像生成" and (image_prompt or current_job("image")):
+    if image_prompt and st.sidebar.button("生成图片", key="gen_img_btn"):
+        st.session_state.jobs["image"] = runner.submit(
+            "image",
+            lambda job, **kwargs: client.images.generate(**kwargs).data[0].url,
+            prompt=image_prompt,
+            model=model if model.startswith("dall") else None,
+            n=1
+        )
+    job = current_job("image")
+    if job:
+        follow_job(job, lambda j: None, "生成中…")
+        if job.status == "done":
+            st.image(job.result)
 
 elif category == "语音识别":
+    def transcribe(job, filename: str, data: bytes):
+        if api:
+            return api.transcribe(filename, data, model=model)
+        return client.audio.transcriptions.create(file=(filename, data), model=model).text
+
     # 上传文件识别
     upload_audio = st.sidebar.file_uploader(
         "上传 音频(可选)", type=["mp3", "wav", "ogg"], key="audio_uploader"
     )
     if upload_audio and st.sidebar.button("识别上传文件", key="recognize_upload"):
-        with st.spinner("音频转写中…"):
-            r = client.audio.transcriptions.create(
-                file=upload_audio,
-                model=model
-            )
-        st.write(r.text)
+        st.session_state.jobs["transcribe"] = runner.submit(
+            "transcribe", transcribe, upload_audio.name, upload_audio.getvalue()
+        )
 
     # 录音并识别
     if webrtc_ctx and webrtc_ctx.audio_receiver and st.sidebar.button("录音并识别", key="recognize_stream"):
@@ -426,23 +810,33 @@ elif category == "语音识别":
             # 播放录音条
             st.audio(wav_bytes, format="audio/wav")
             # 转写
-            with st.spinner("录音转写中…"):
-                buf2 = BytesIO(wav_bytes)
-                buf2.name = "recording.wav"
-                r2 = client.audio.transcriptions.create(
-                    file=buf2,
-                    model=model
-                )
-            st.write(r2.text)
+            st.session_state.jobs["transcribe"] = runner.submit(
+                "transcribe", transcribe, "recording.wav", wav_bytes
+            )
 
-elif category == "语音合成" and gen_tts and tts_prompt:
-    with st.spinner("生成语音…"):
-        r = client.audio.speech.create(input=tts_prompt, voice=voice, model=model)
-    try:
-        audio_bytes = r.read()
-    except:
-        audio_bytes = bytes(r)
-    st.audio(audio_bytes)
+    job = current_job("transcribe")
+    if job:
+        follow_job(job, lambda j: None, "音频转写中…")
+        if job.status == "done":
+            st.write(job.result)
+
+elif category == "语音合成" and ((gen_tts and tts_prompt) or current_job("tts")):
+    if gen_tts and tts_prompt:
+        def synthesize(job, text: str, voice: str):
+            if api:
+                return api.speech(text, model=model, voice=voice)
+            r = client.audio.speech.create(input=text, voice=voice, model=model)
+            try:
+                return r.read()
+            except:
+                return bytes(r)
+
+        st.session_state.jobs["tts"] = runner.submit("tts", synthesize, tts_prompt, voice)
+    job = current_job("tts")
+    if job:
+        follow_job(job, lambda j: None, "生成语音…")
+        if job.status == "done":
+            st.audio(job.result)
 
 elif category == "代码模型" and code_request:
     with st.spinner("生成代码…"):
@@ -469,6 +863,16 @@ elif category == "代码模型" and code_request:
 
 else:
     # 聊天 & 多模态
+    if st.session_state.messages and st.sidebar.button("导出聊天 PDF", key="export_chat_pdf"):
+        with st.spinner("正在导出 PDF…"):
+            offer_pdf_download(
+                "聊天记录",
+                [f"生成日期：{today_text()}", f"模型：{model}"],
+                chat_sections(st.session_state.messages),
+                file_name="聊天记录.pdf",
+                key="chat_pdf"
+            )
+
     if st.session_state.session_pdfs:
         st.markdown("**已上传 PDF 附件**")
         cols = st.columns(len(st.session_state.session_pdfs))
@@ -492,13 +896,34 @@ else:
         else:
             st.chat_message(role).markdown(content)
 
-    if prompt := st.chat_input("输入消息…"):
+    # 上一轮回答仍在后台生成时暂不接受新消息，避免对话顺序错乱
+    chat_job = current_job("chat")
+    chat_busy = bool(chat_job and not chat_job.done)
+    prompt = st.chat_input("输入消息…", disabled=chat_busy)
+    if prompt and chat_busy:
+        st.toast("上一条回答仍在生成中，请稍候再发送")
+        prompt = None
+    if prompt:
         parts = [{"type": "text", "text": prompt}]
-        for pdf_file in st.session_state.session_pdfs:
-            raw = pdf_file.read()
-            txt = extract_text(BytesIO(raw))
-            excerpt = txt[:trunc_chars] + "…" if truncate_pdf and trunc_chars else txt
-            parts.append({"type": "text", "text": excerpt, "filename": pdf_file.name})
+        if use_retrieval and st.session_state.session_pdfs:
+            index = get_document_index()
+            names = {}
+            with st.spinner("建立 PDF 检索索引…"):
+                for pdf_file in st.session_state.session_pdfs:
+                    raw = pdf_file.read()
+                    doc_id = document_hash(raw)
+                    names[doc_id] = pdf_file.name
+                    if doc_id not in index:
+                        index.add_document(client, doc_id, extract_text(BytesIO(raw)))
+                hits = index.search(client, prompt, list(names), top_k=retrieval_top_k)
+            for doc_id, chunk_no, passage, _ in hits:
+                parts.append({"type": "text", "text": passage, "filename": f"{names[doc_id]}（片段 {chunk_no + 1}）"})
+        else:
+            for pdf_file in st.session_state.session_pdfs:
+                raw = pdf_file.read()
+                txt = extract_text(BytesIO(raw))
+                excerpt = txt[:trunc_chars] + "…" if truncate_pdf and trunc_chars else txt
+                parts.append({"type": "text", "text": excerpt, "filename": pdf_file.name})
         for img in st.session_state.session_images:
             raw = img.read()
             mime, _ = guess_type(img.name)
@@ -518,11 +943,39 @@ else:
         st.session_state.session_pdfs = []
         st.session_state.session_images = []
 
-        with st.spinner("思考中…"):
-            r = client.chat.completions.create(
-                model=model,
-                messages=st.session_state.messages
+        messages = list(st.session_state.messages)
+        if use_semantic_cache:
+            cache = get_semantic_cache()
+
+            def answer_with_cache(job):
+                ans, job.meta["cache_hit"] = cached_chat_completion(
+                    cache, client, model, messages, threshold=cache_threshold
+                )
+                return ans
+
+            st.session_state.jobs["chat"] = runner.submit("chat", answer_with_cache)
+        elif api:
+            st.session_state.jobs["chat"] = runner.submit_stream("chat", api.chat_stream, model, messages)
+        else:
+            # 流式生成，页面随时显示已生成的部分；温度与长度使用模型默认值；与其他会话的相同请求合并为一次上游调用
+            st.session_state.jobs["chat"] = runner.submit_stream(
+                "chat", chat_completion_stream, client, model, messages, temperature=None, max_tokens=None
             )
-        ans = r.choices[0].message.content
-        st.session_state.messages.append({"role": "assistant", "content": ans})
-        st.chat_message("assistant").markdown(ans)
+
+    # —— 渲染进行中的回答；重跑后继续接上，完成后写入对话历史 ——
+    chat_job = current_job("chat")
+    if chat_job:
+        box = st.chat_message("assistant").empty()
+        follow_job(
+            chat_job,
+            lambda j: box.markdown(j.result if j.status == "done" else (j.text or "⏳ 思考中…")),
+            "思考中…"
+        )
+        if chat_job.status == "done":
+            st.session_state.messages.append({"role": "assistant", "content": chat_job.result})
+            if chat_job.meta.get("cache_hit"):
+                st.caption("⚡ 已命中语义缓存")
+        st.session_state.jobs.pop("chat", None)
+        if chat_busy:
+            # 输入框在生成期间被禁用，完成后重跑一次以恢复输入
+            st.rerun()
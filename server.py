@@ -0,0 +1,300 @@
+# 文件：server.py
+#
+# 无界面的 HTTP 服务：把聊天、八字报告、语音转写、语音合成、Markdown 转 PDF
+# 等核心能力以异步接口暴露出来，Streamlit 页面只是它的一个客户端。
+#
+# 启动（多 worker 横向扩展）：
+#     uvicorn server:app --host 0.0.0.0 --port 8000 --workers 4
+
+import asyncio
+import hashlib
+import hmac
+import os
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import Depends, FastAPI, File, Form, Header, HTTPException, UploadFile
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from openai import APIConnectionError, APIStatusError
+from starlette.background import BackgroundTask
+from pydantic import BaseModel
+
+from utils.bazi_prompts import BIRTH_FORMAT, build_pair_messages, build_personal_messages
+from utils.chatgpt_client import async_chat_completion, async_chat_completion_stream, get_async_client
+from utils.key_pool import get_key_pool
+from utils.pdf_generator import export_pdf_to_tempfile, generate_pdf_from_markdown
+from utils.report_fanout import async_personal_report_fanout
+
+# 单次上游请求的超时秒数
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "120"))
+
+app = FastAPI(title="ChatGPT API 平台", version="1.0")
+
+# 服务令牌：逗号分隔；调用方不自带 Key 而使用服务端 Key 池 / OPENAI_API_KEY，或查看 Key 用量时，
+# 须通过 X-Service-Token 请求头提供其中之一；未配置时服务端凭据不对外开放
+SERVICE_TOKENS = [t.strip() for t in os.getenv("SERVICE_TOKENS", "").split(",") if t.strip()]
+
+# 请求头传入的 Key 最多复用的客户端数，超出后淘汰最久未用的
+MAX_HEADER_CLIENTS = int(os.getenv("MAX_HEADER_CLIENTS", "32"))
+
+# 服务端自身配置（Key 池或 OPENAI_API_KEY）的客户端只有一个，长期复用
+_server_client = None
+# 请求头 Key 的客户端：按 Key 的哈希索引，LRU 淘汰，避免连接池与 Key 无限累积
+_header_clients = OrderedDict()
+
+
+def require_service_token(x_service_token: Optional[str] = Header(None)):
+    """
+    校验 X-Service-Token；用于会消耗或暴露服务端凭据的请求。
+    """
+    if not x_service_token or not any(hmac.compare_digest(x_service_token, t) for t in SERVICE_TOKENS):
+        raise HTTPException(status_code=401, detail="使用服务端 Key 需要有效的服务令牌（X-Service-Token 请求头）")
+
+
+async def openai_client(x_openai_key: Optional[str] = Header(None), x_service_token: Optional[str] = Header(None)):
+    """
+    按请求选择上游客户端：请求头中的 Key 优先；否则在服务令牌有效时使用服务端 Key 池
+    （OPENAI_API_KEYS / OPENAI_KEY_POOL_FILE）或 OPENAI_API_KEY。
+    """
+    global _server_client
+    if not x_openai_key:
+        require_service_token(x_service_token)
+        if not (get_key_pool() or os.getenv("OPENAI_API_KEY")):
+            raise HTTPException(status_code=401, detail="必须提供 OpenAI API Key（X-OpenAI-Key 请求头或服务端环境变量）")
+        if _server_client is None:
+            _server_client = get_async_client(timeout=REQUEST_TIMEOUT)
+        return _server_client
+    digest = hashlib.sha256(x_openai_key.encode("utf-8")).hexdigest()
+    client = _header_clients.pop(digest, None) or get_async_client(x_openai_key, timeout=REQUEST_TIMEOUT)
+    _header_clients[digest] = client
+    while len(_header_clients) > MAX_HEADER_CLIENTS:
+        _, evicted = _header_clients.popitem(last=False)
+        await evicted.close()
+    return client
+
+
+def _parse_birth(value: str) -> str:
+    """
+    接受 “YYYY-MM-DD HH:MM” 或 ISO 格式的出生时间，返回模型使用的中文格式。
+    """
+    try:
+        return datetime.fromisoformat(value).strftime(BIRTH_FORMAT)
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"无法解析出生时间：{value}")
+
+
+class ChatRequest(BaseModel):
+    model: str
+    messages: List[dict]
+    # 为 None 时不传给上游，使用模型默认值（推理模型不接受这两个参数）
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+    stream: bool = False
+
+
+class Person(BaseModel):
+    name: str
+    gender: str
+    birth: str
+
+
+class PersonalReportRequest(Person):
+    model: str = "chatgpt-4o-latest"
+    today: Optional[str] = None
+    stream: bool = False
+    # 为 True 时按章节分组并行生成，见 utils/report_fanout.py
+    fanout: bool = False
+
+
+class PairReportRequest(BaseModel):
+    person1: Person
+    person2: Person
+    model: str = "chatgpt-4o-latest"
+    today: Optional[str] = None
+    stream: bool = False
+
+
+class SpeechRequest(BaseModel):
+    input: str
+    model: str = "tts-1"
+    voice: str = "alloy"
+
+
+class PdfRequest(BaseModel):
+    title: str
+    info_lines: List[str] = []
+    markdown: str
+
+
+class PdfSection(BaseModel):
+    heading: str = ""
+    markdown: str
+
+
+class PdfExportRequest(BaseModel):
+    title: str
+    info_lines: List[str] = []
+    sections: List[PdfSection]
+
+
+async def _stream_response(chunks) -> StreamingResponse:
+    """
+    先取到第一个片段再返回 200 流式响应：Key 无效、限流、模型不存在等上游错误
+    发生在首个片段之前，可以映射为对应的 HTTP 状态码，而不是一个被截断的响应体。
+    """
+    try:
+        first = await asyncio.wait_for(chunks.__anext__(), timeout=REQUEST_TIMEOUT)
+    except StopAsyncIteration:
+        first = ""
+    except asyncio.TimeoutError:
+        await chunks.aclose()
+        raise HTTPException(status_code=504, detail="上游模型请求超时")
+
+    async def body():
+        try:
+            if first:
+                yield first
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    return StreamingResponse(body(), media_type="text/plain; charset=utf-8")
+
+
+async def _complete(client, model: str, messages: list, temperature: float, max_tokens: int, stream: bool):
+    """
+    chat / 八字报告共用：stream=True 时返回纯文本流，否则返回 JSON。
+    """
+    if stream:
+        return await _stream_response(async_chat_completion_stream(client, model, messages, temperature, max_tokens))
+    try:
+        content = await asyncio.wait_for(
+            async_chat_completion(client, model, messages, temperature, max_tokens),
+            timeout=REQUEST_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="上游模型请求超时")
+    return {"model": model, "content": content}
+
+
+async def _join(chunks) -> str:
+    return "".join([chunk async for chunk in chunks])
+
+
+@app.get("/healthz")
+async def healthz():
+    """存活探针：进程能响应即视为健康。"""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """就绪探针：服务端未配置 Key 时仍可就绪，但需由调用方通过请求头传入。"""
+    pool = get_key_pool()
+    return {
+        "status": "ready",
+        "server_key": bool(os.getenv("OPENAI_API_KEY")),
+        "pool_keys": len(pool) if pool else 0,
+    }
+
+
+@app.get("/v1/keys", dependencies=[Depends(require_service_token)])
+async def key_usage():
+    """服务端 Key 池各 Key 的用量（Key 已脱敏）。"""
+    pool = get_key_pool()
+    return {"keys": pool.stats() if pool else []}
+
+
+@app.post("/v1/chat")
+async def chat(req: ChatRequest, client=Depends(openai_client)):
+    return await _complete(client, req.model, req.messages, req.temperature, req.max_tokens, req.stream)
+
+
+@app.post("/v1/bazi/personal")
+async def bazi_personal(req: PersonalReportRequest, client=Depends(openai_client)):
+    birth_text = _parse_birth(req.birth)
+    if req.fanout:
+        sections = async_personal_report_fanout(client, req.model, req.name, req.gender, birth_text, req.today)
+        if req.stream:
+            return await _stream_response(sections)
+        try:
+            content = await asyncio.wait_for(_join(sections), timeout=REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="上游模型请求超时")
+        return {"model": req.model, "content": content}
+    messages = build_personal_messages(req.name, req.gender, birth_text, req.today)
+    return await _complete(client, req.model, messages, 0.7, 2048, req.stream)
+
+
+@app.post("/v1/bazi/pair")
+async def bazi_pair(req: PairReportRequest, client=Depends(openai_client)):
+    p1, p2 = req.person1, req.person2
+    messages = build_pair_messages(
+        p1.name, p1.gender, _parse_birth(p1.birth),
+        p2.name, p2.gender, _parse_birth(p2.birth),
+        req.today
+    )
+    return await _complete(client, req.model, messages, 0.7, 2048, req.stream)
+
+
+@app.post("/v1/audio/transcriptions")
+async def transcriptions(
+    file: UploadFile = File(...),
+    model: str = Form("whisper-1"),
+    client=Depends(openai_client),
+):
+    raw = await file.read()
+    try:
+        r = await asyncio.wait_for(
+            client.audio.transcriptions.create(file=(file.filename or "audio.wav", raw), model=model),
+            timeout=REQUEST_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="上游模型请求超时")
+    return {"model": model, "text": r.text}
+
+
+@app.post("/v1/audio/speech")
+async def speech(req: SpeechRequest, client=Depends(openai_client)):
+    try:
+        r = await asyncio.wait_for(
+            client.audio.speech.create(input=req.input, voice=req.voice, model=req.model),
+            timeout=REQUEST_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="上游模型请求超时")
+    return Response(content=r.content, media_type="audio/mpeg")
+
+
+@app.post("/v1/pdf")
+async def markdown_pdf(req: PdfRequest):
+    # ReportLab 是同步且 CPU 密集的，放到线程池中执行，避免阻塞事件循环
+    pdf_bytes = await asyncio.to_thread(generate_pdf_from_markdown, req.title, req.info_lines, req.markdown)
+    return Response(content=pdf_bytes, media_type="application/pdf")
+
+
+@app.post("/v1/pdf/export")
+async def export_pdf(req: PdfExportRequest):
+    # 长文档逐段排版写入临时文件，再直接从磁盘发送，发送完毕后删除
+    sections = ((s.heading, s.markdown) for s in req.sections)
+    path = await asyncio.to_thread(export_pdf_to_tempfile, req.title, req.info_lines, sections)
+    return FileResponse(path, media_type="application/pdf", filename="export.pdf",
+                        background=BackgroundTask(os.remove, path))
+
+
+@app.exception_handler(ValueError)
+async def value_error_handler(request, exc: ValueError):
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+
+@app.exception_handler(APIStatusError)
+async def upstream_status_handler(request, exc: APIStatusError):
+    # 上游的 401 / 404 / 429 等原样返回给调用方
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.message})
+
+
+@app.exception_handler(APIConnectionError)
+async def upstream_connection_handler(request, exc: APIConnectionError):
+    return JSONResponse(status_code=502, content={"detail": f"无法连接上游模型服务：{exc}"})
@@ -0,0 +1,75 @@
+# 文件：utils/api_client.py
+
+import os
+import httpx
+
+# 配置 API_BASE_URL 后，Streamlit 页面改为调用 server.py 暴露的 HTTP 接口
+API_BASE_URL = os.getenv("API_BASE_URL", None)
+# 不填写 Key、使用服务端 Key 池时需提供的服务令牌（对应服务端 SERVICE_TOKENS 之一）
+SERVICE_TOKEN = os.getenv("SERVICE_TOKEN", None)
+
+
+class ApiClient:
+    """
+    server.py 的轻量 HTTP 客户端，方法与服务端接口一一对应。
+
+    - base_url: 服务地址，例如 "http://127.0.0.1:8000"
+    - api_key: 转发给服务端的 OpenAI API Key（X-OpenAI-Key 请求头），为空时由服务端使用自身配置
+    - service_token: 使用服务端配置时的服务令牌（X-Service-Token 请求头）
+    - timeout: 单次 HTTP 请求的超时秒数
+    """
+
+    def __init__(self, base_url: str, api_key: str = None, service_token: str = None, timeout: float = 180):
+        headers = {"X-OpenAI-Key": api_key} if api_key else {}
+        if service_token:
+            headers["X-Service-Token"] = service_token
+        self._http = httpx.Client(base_url=base_url.rstrip("/"), headers=headers, timeout=timeout)
+
+    def _post_stream(self, path: str, payload: dict):
+        with self._http.stream("POST", path, json={**payload, "stream": True}) as r:
+            r.raise_for_status()
+            for text in r.iter_text():
+                if text:
+                    yield text
+
+    def chat_stream(self, model: str, messages: list, temperature: float = None, max_tokens: int = None):
+        """
+        - temperature / max_tokens: 为 None 时由服务端使用模型默认值
+        """
+        payload = {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens}
+        return self._post_stream("/v1/chat", payload)
+
+    def bazi_personal_stream(self, model: str, name: str, gender: str, birth: str, today: str = None,
+                             fanout: bool = False):
+        """
+        - birth: ISO 格式出生时间，例如 "2000-01-01T03:00"
+        - fanout: 是否按章节分组并行生成
+        """
+        payload = {"model": model, "name": name, "gender": gender, "birth": birth, "today": today, "fanout": fanout}
+        return self._post_stream("/v1/bazi/personal", payload)
+
+    def bazi_pair_stream(self, model: str, person1: dict, person2: dict, today: str = None):
+        """
+        - person1 / person2: {"name": ..., "gender": ..., "birth": ISO 格式出生时间}
+        """
+        payload = {"model": model, "person1": person1, "person2": person2, "today": today}
+        return self._post_stream("/v1/bazi/pair", payload)
+
+    def transcribe(self, filename: str, data: bytes, model: str = "whisper-1") -> str:
+        r = self._http.post("/v1/audio/transcriptions", files={"file": (filename, data)}, data={"model": model})
+        r.raise_for_status()
+        return r.json()["text"]
+
+    def speech(self, text: str, model: str = "tts-1", voice: str = "alloy") -> bytes:
+        r = self._http.post("/v1/audio/speech", json={"input": text, "model": model, "voice": voice})
+        r.raise_for_status()
+        return r.content
+
+
+def get_api_client(api_key: str = None):
+    """
+    未配置 API_BASE_URL 时返回 None，页面继续直连 OpenAI。
+    """
+    if not API_BASE_URL:
+        return None
+    return ApiClient(API_BASE_URL, api_key=api_key, service_token=SERVICE_TOKEN)
@@ -0,0 +1,157 @@
+# 文件：utils/bazi_match.py
+
+import csv
+import io
+from datetime import datetime
+
+import numpy as np
+
+STEMS = "甲乙丙丁戊己庚辛壬癸"
+BRANCHES = "子丑寅卯辰巳午未申酉戌亥"
+ZODIAC = "鼠牛虎兔龙蛇马羊猴鸡狗猪"
+
+# 1949-10-01 为甲子日，作为日柱推算基准
+_DAY_REF = np.datetime64("1949-10-01", "D")
+
+# 各关系的加减分
+WEIGHTS = {
+    "六合": 3.0,
+    "三合": 2.0,
+    "六冲": -3.0,
+    "相刑": -2.0,
+    "相害": -2.0,
+    "天干五合": 2.0,
+    "天干相冲": -2.0,
+}
+# 年支（生肖）与日支（夫妻宫）的权重，日支对婚配影响更大
+YEAR_BRANCH_WEIGHT = 1.0
+DAY_BRANCH_WEIGHT = 1.5
+
+
+def _branch_tables() -> dict:
+    idx = {b: i for i, b in enumerate(BRANCHES)}
+    tables = {name: np.zeros((12, 12), dtype=bool) for name in ("六合", "三合", "六冲", "相刑", "相害")}
+
+    def mark(name, a, b):
+        tables[name][idx[a], idx[b]] = tables[name][idx[b], idx[a]] = True
+
+    for a, b in ("子丑", "寅亥", "卯戌", "辰酉", "巳申", "午未"):
+        mark("六合", a, b)
+    for i in range(12):
+        for j in range(12):
+            # 申子辰、亥卯未、寅午戌、巳酉丑：下标模 4 同余即同一三合局
+            tables["三合"][i, j] = i != j and i % 4 == j % 4
+            tables["六冲"][i, j] = abs(i - j) == 6
+    for a, b in ("子卯", "寅巳", "巳申", "申寅", "丑戌", "戌未", "未丑"):
+        mark("相刑", a, b)
+    for a in "辰午酉亥":
+        mark("相刑", a, a)
+    for a, b in ("子未", "丑午", "寅巳", "卯辰", "申亥", "酉戌"):
+        mark("相害", a, b)
+    return tables
+
+
+def _stem_tables() -> dict:
+    tables = {name: np.zeros((10, 10), dtype=bool) for name in ("天干五合", "天干相冲")}
+    for i in range(10):
+        for j in range(10):
+            # 甲己、乙庚、丙辛、丁壬、戊癸相合；甲庚、乙辛、丙壬、丁癸相冲（戊己居中不冲）
+            tables["天干五合"][i, j] = abs(i - j) == 5
+            tables["天干相冲"][i, j] = abs(i - j) == 6
+    return tables
+
+
+BRANCH_RELATIONS = _branch_tables()
+STEM_RELATIONS = _stem_tables()
+
+# 预先把各关系按权重合成为打分表，排名时只需查表
+BRANCH_SCORE = sum(WEIGHTS[name] * table for name, table in BRANCH_RELATIONS.items())
+STEM_SCORE = sum(WEIGHTS[name] * table for name, table in STEM_RELATIONS.items())
+
+
+def pillar_indices(births: list) -> dict:
+    """
+    批量推算年柱（以 2 月 4 日近似立春为界）与日柱的天干、地支下标。
+
+    返回：
+    - {"year_stem", "year_branch", "day_stem", "day_branch"}，均为与 births 等长的整数数组
+    """
+    dates = np.array([b.date() for b in births], dtype="datetime64[D]")
+    year_start = dates.astype("datetime64[Y]")
+    years = year_start.astype(np.int64) + 1970
+    # 2 月 4 日之前仍属上一年（1 月 1 日起第 34 天为 2 月 4 日）
+    years -= (dates - year_start.astype("datetime64[D]")).astype(np.int64) < 34
+    days = (dates - _DAY_REF).astype(np.int64) % 60
+    return {
+        "year_stem": (years - 4) % 10,
+        "year_branch": (years - 4) % 12,
+        "day_stem": days % 10,
+        "day_branch": days % 12,
+    }
+
+
+def pillar_text(birth: datetime) -> str:
+    """
+    例如 “庚辰年（龙） 戊午日”。
+    """
+    p = {k: int(v[0]) for k, v in pillar_indices([birth]).items()}
+    return (
+        f"{STEMS[p['year_stem']]}{BRANCHES[p['year_branch']]}年（{ZODIAC[p['year_branch']]}） "
+        f"{STEMS[p['day_stem']]}{BRANCHES[p['day_branch']]}日"
+    )
+
+
+def rank_candidates(person_birth: datetime, candidate_births: list):
+    """
+    用查表对整个候选池打分并排序，不调用模型。
+
+    返回：
+    - (order, scores)：order 为按分数从高到低排列的候选下标，scores 为各候选原始分数
+    """
+    me = pillar_indices([person_birth])
+    pool = pillar_indices(candidate_births)
+    scores = (
+        YEAR_BRANCH_WEIGHT * BRANCH_SCORE[me["year_branch"][0], pool["year_branch"]]
+        + DAY_BRANCH_WEIGHT * BRANCH_SCORE[me["day_branch"][0], pool["day_branch"]]
+        + STEM_SCORE[me["day_stem"][0], pool["day_stem"]]
+    )
+    order = np.argsort(-scores, kind="stable")
+    return order, scores
+
+
+def relation_labels(person_birth: datetime, candidate_birth: datetime) -> list:
+    """
+    列出两人之间命中的关系，例如 ["生肖六合", "日支相害", "日干天干五合"]，用于展示排名依据。
+    """
+    p = pillar_indices([person_birth, candidate_birth])
+    labels = []
+    for prefix, key in (("生肖", "year_branch"), ("日支", "day_branch")):
+        a, b = p[key]
+        labels.extend(prefix + name for name, table in BRANCH_RELATIONS.items() if table[a, b])
+    a, b = p["day_stem"]
+    labels.extend("日干" + name for name, table in STEM_RELATIONS.items() if table[a, b])
+    return labels
+
+
+def parse_candidates(text: str):
+    """
+    解析候选名单，每行 “姓名,性别,出生时间”，出生时间形如 2000-01-01 08:30（时间可省略）。
+
+    返回：
+    - (candidates, errors)：candidates 为 [(姓名, 性别, datetime)]，errors 为无法解析的行说明
+    """
+    candidates, errors = [], []
+    for line_no, row in enumerate(csv.reader(io.StringIO(text)), start=1):
+        row = [c.strip() for c in row]
+        if not any(row) or row[0].startswith("#"):
+            continue
+        if len(row) < 3:
+            errors.append(f"第 {line_no} 行字段不足：{','.join(row)}")
+            continue
+        try:
+            birth = datetime.fromisoformat(row[2])
+        except ValueError:
+            errors.append(f"第 {line_no} 行出生时间无法解析：{row[2]}")
+            continue
+        candidates.append((row[0], row[1], birth))
+    return candidates, errors
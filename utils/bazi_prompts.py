@@ -0,0 +1,161 @@
+# 文件：utils/bazi_prompts.py
+
+from datetime import datetime
+
+# 出生时间统一格式，模型与 PDF 报头都使用这一格式
+BIRTH_FORMAT = "%Y年%m月%d日 %H时%M分"
+
+# 个人运势报告的 13 个章节要求，整篇生成与分段并行生成共用
+PERSONAL_SECTIONS = [
+    "1. # 个人信息：确认用户姓名、性别、出生信息，用以报头。\n",
+    "2. ## 八字：按天干地支列出“年柱、月柱、日柱、时柱”，并简要说明各柱间的相生相克。\n",
+    "3. ## 大运：列出该用户从出生日开始的每十年一个大运节点，并解释各大运主要吉凶变化，至少列出前三个大运。\n",
+    "4. ## 流年流月运势：\n"
+    "   - 以“参考日期”做基准，给出**最近三年每年流年运势**要点（至少包含事业、财运、感情、健康）。\n"
+    "   - 结合**最近一个月份**和**下一个两个月份**，给出流月运势，指出关键吉凶事件。\n",
+    "5. ## 五行分析：说明八字中各五行的旺衰或缺失，并指出是否需要某个五行调和。\n",
+    "6. ## 喜用神：根据五行格局，建议最合适的喜用神，并说明理由。\n",
+    "7. ## 幸运色 / 幸运数字 / 幸运方位：根据缺失与调和需求，推荐具体颜色、数字和方位，并举例说明日常应用（如穿衣、摆件、家居布局）。\n",
+    "8. ## 事业学业：结合八字与流年流月，详细描述事业或学业机遇与挑战，并给出可落地的行动建议。\n",
+    "9. ## 感情桃花：说明当前感情/桃花运势趋势，结合流年流月给出择偶/交友建议，并提示重要吉日或时辰。\n",
+    "10. ## 健康：指出需关注的健康风险（如五行过旺/过弱对身体影响），并给出调养方案（饮食、运动、作息等）。\n",
+    "11. ## 财运：结合流年流月预测近期财运走势（正财 + 偏财），并给出理财/投资时机建议。\n",
+    "12. ## 六亲关系：简要说明父母、配偶、子女等与八字五行的相生相克关系，并给出家庭沟通或相处建议。\n",
+    "13. ## 结论与建议：最后做全局总结，语言要接地气，贴近生活。\n",
+]
+
+_PERSONAL_ROLE = (
+    "你是一位经验丰富的中文命理师，擅长八字排盘、流年流月运势分析、五行格局、喜用神、"
+    "幸运色/数字/方位推荐、事业学业、感情桃花、健康风险、财运走势、六亲关系以及化解或增益建议。"
+)
+
+PERSONAL_SYSTEM_PROMPT = (
+    _PERSONAL_ROLE
+    + "请以 **Markdown** 格式输出以下内容：\n"
+    + "".join(PERSONAL_SECTIONS)
+    + "请使用 Markdown 的标题、列表、粗体等格式，整篇文字不少于 1000 字。"
+)
+
+# 分段并行生成时的章节分组：(分组名称, PERSONAL_SECTIONS 中的下标)
+PERSONAL_SECTION_GROUPS = [
+    ("八字 / 大运", [0, 1, 2]),
+    ("流年流月", [3]),
+    ("五行 / 喜用神", [4, 5, 6]),
+    ("事业 / 感情 / 健康 / 财运", [7, 8, 9, 10]),
+    ("六亲 / 结论", [11, 12]),
+]
+
+PAIR_SYSTEM_PROMPT = (
+    "你是一位资深的中文命理师，精通八字配对与星宿关系分析。"
+    "请以 **Markdown** 格式输出以下内容：\n"
+    "1. **个人简介**：重复列出双方姓名、性别、出生信息，以便报头。\n"
+    "2. **八字排盘**：分别列出双方“年柱、月柱、日柱、时柱”（天干地支），并简要说明各柱五行旺衰。\n"
+    "3. **星宿/生肖/天干地支配对**：详细分析两人五行相生相克、地支三合三会、天干合冲等关系，说明是否相合、相冲、相刑或相害，对双方感情或合作的影响。\n"
+    "4. **大运与流年对比**：结合“参考日期”，分别给出双方当前与下一步大运节点，并对比大运与当前流年运势，说明两人何时最易相合或相冲。\n"
+    "5. **配对吉凶评估**：根据八字和大运流年对比，给出整体配对吉凶结论，至少包含情感/婚姻层面与事业/合作层面两方面。\n"
+    "6. **日常相处建议**：结合双方八字和五行特点，给出具体生活化建议（如“宜在阴历X月Y日举办婚礼”，或“佩戴金饰、红色摆件以化解冲煞”）。\n"
+    "7. **化解或增益方法**：如果存在冲克或冲煞，说明可采用的化解方式（佩戴何种饰品、家中摆放何物、工作座位方位等）。\n"
+    "8. **结论**：最后给出全局总结，语言生动接地气，条理清晰，字数不少于 800 字。\n"
+)
+
+
+def today_text() -> str:
+    """
+    返回当前日期文本，传给模型做“近期”基准。
+    """
+    return datetime.now().strftime("%Y年%m月%d日")
+
+
+def format_birth(birth_dt: datetime) -> str:
+    """
+    把出生时间格式化为 “YYYY年MM月DD日 HH时MM分”。
+    """
+    return birth_dt.strftime(BIRTH_FORMAT)
+
+
+def build_personal_messages(name: str, gender: str, birth_text: str, today: str = None) -> list:
+    """
+    构造“个人运势查询”的 Chat 消息列表。
+
+    - name / gender: 姓名与性别
+    - birth_text: 已格式化的出生时间，见 format_birth
+    - today: 参考日期，默认取当天
+    """
+    today = today or today_text()
+    user_prompt = (
+        f"参考日期（今天）：**{today}**。\n\n"
+        f"**用户信息**：姓名：**{name}**；性别：**{gender}**；出生：**{birth_text}**。\n\n"
+        "请按照上述要求输出详细运势分析。"
+    )
+    return [
+        {"role": "system", "content": PERSONAL_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def build_pair_messages(name1: str, gender1: str, birth_text1: str,
+                        name2: str, gender2: str, birth_text2: str,
+                        today: str = None) -> list:
+    """
+    构造“两人星宿配对”的 Chat 消息列表，参数含义同 build_personal_messages。
+    """
+    today = today or today_text()
+    user_prompt = (
+        f"参考日期（今天）：**{today}**。\n\n"
+        f"**用户1**：姓名：**{name1}**；性别：**{gender1}**；出生：**{birth_text1}**。\n"
+        f"**用户2**：姓名：**{name2}**；性别：**{gender2}**；出生：**{birth_text2}**。\n\n"
+        "请根据上述要求，输出完整八字配对与星宿关系分析。"
+    )
+    return [
+        {"role": "system", "content": PAIR_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def build_chart_messages(name: str, gender: str, birth_text: str, today: str = None) -> list:
+    """
+    构造“只排盘”的简短请求：分段并行生成前先确定四柱与大运，作为各分段共享的上下文，
+    避免不同分段各自排盘得出不一致的八字。
+    """
+    today = today or today_text()
+    system_prompt = (
+        _PERSONAL_ROLE
+        + "请只做排盘，不做任何分析，用简洁的 Markdown 列表输出：年柱、月柱、日柱、时柱（天干地支），"
+        "日主及五行个数统计，起运年龄与前三个大运的干支及起止年份。"
+    )
+    user_prompt = (
+        f"参考日期（今天）：**{today}**。\n\n"
+        f"**用户信息**：姓名：**{name}**；性别：**{gender}**；出生：**{birth_text}**。"
+    )
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def build_section_messages(group_index: int, name: str, gender: str, birth_text: str,
+                           chart: str, today: str = None) -> list:
+    """
+    构造分段并行生成中第 group_index 组章节的消息列表。
+
+    - chart: build_chart_messages 得到的排盘结果，各分段统一以此为准
+    """
+    today = today or today_text()
+    _, indexes = PERSONAL_SECTION_GROUPS[group_index]
+    system_prompt = (
+        _PERSONAL_ROLE
+        + "完整报告由多位命理师分段撰写，你只负责其中以下章节，请以 **Markdown** 格式输出，"
+        "不要输出其他章节，也不要添加开场白或总结：\n"
+        + "".join(PERSONAL_SECTIONS[i] for i in indexes)
+        + "请使用 Markdown 的标题、列表、粗体等格式，内容务必详实。"
+    )
+    user_prompt = (
+        f"参考日期（今天）：**{today}**。\n\n"
+        f"**用户信息**：姓名：**{name}**；性别：**{gender}**；出生：**{birth_text}**。\n\n"
+        f"**排盘结果（以此为准，不要重新排盘）**：\n{chart}\n\n"
+        "请按照上述要求输出负责的章节。"
+    )
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
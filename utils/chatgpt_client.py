@@ -1,21 +1,66 @@
+import hashlib
 import os
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+
+from .key_pool import get_key_pool, PooledOpenAI, AsyncPooledOpenAI
+from .single_flight import SingleFlight, AsyncSingleFlight, request_key
 
 # 可以在环境变量中配置 OPENAI_API_KEY，否则在 app.py 中传入
 _api_key = os.getenv("OPENAI_API_KEY", None)
 
+# 进程内的请求合并表：并发的相同请求（同一凭据下模型 + 消息 + 参数一致）只向上游发送一次
+_flights = SingleFlight()
+_async_flights = AsyncSingleFlight()
+
 
 def get_client(api_key: str = None) -> OpenAI:
     """
-    返回一个 OpenAI 客户端实例。优先使用传入的 api_key，否则尝试环境变量。
+    返回一个 OpenAI 客户端实例。优先使用传入的 api_key，其次是服务端 Key 池，最后尝试环境变量。
     """
+    if not api_key and get_key_pool():
+        return PooledOpenAI(get_key_pool())
     key = api_key or _api_key
     if not key:
         raise ValueError("必须提供 OpenAI API Key")
     return OpenAI(api_key=key)
 
 
-def chat_completion(client: OpenAI, model: str, messages: list, temperature: float = 0.7, max_tokens: int = 2048):
+def get_async_client(api_key: str = None, timeout: float = None) -> AsyncOpenAI:
+    """
+    返回一个 AsyncOpenAI 客户端实例，供 HTTP 服务等异步场景使用。
+
+    - timeout: 单次上游请求的超时秒数，为 None 时使用 SDK 默认值
+    """
+    if not api_key and get_key_pool():
+        return AsyncPooledOpenAI(get_key_pool(), timeout=timeout)
+    key = api_key or _api_key
+    if not key:
+        raise ValueError("必须提供 OpenAI API Key")
+    if timeout is None:
+        return AsyncOpenAI(api_key=key)
+    return AsyncOpenAI(api_key=key, timeout=timeout)
+
+
+def _credential(client) -> str:
+    """
+    客户端所用凭据的标识，作为请求合并键的一部分：不同 Key 的相同请求不会合并，
+    避免一个用户的请求记到另一个用户的 Key 上，或共享另一个 Key 的报错。
+    Key 池客户端统一为 "pool"，其他客户端取 Key 与服务地址的哈希，不保留明文 Key。
+    """
+    if isinstance(client, (PooledOpenAI, AsyncPooledOpenAI)):
+        return "pool"
+    raw = f"{getattr(client, 'base_url', '')}|{getattr(client, 'api_key', '')}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _params(temperature, max_tokens) -> dict:
+    # 为 None 的参数不传给接口，使用模型默认值
+    params = {"temperature": temperature, "max_tokens": max_tokens}
+    return {k: v for k, v in params.items() if v is not None}
+
+
+def chat_completion(client: OpenAI, model: str, messages: list, temperature: float = 0.7, max_tokens: int = 2048,
+                    coalesce: bool = True):
     """
     统一封装对 OpenAI Chat Completion 的调用。
 
@@ -23,16 +68,107 @@ def chat_completion(client: OpenAI, model: str, messages: list, temperature: flo
     - client: OpenAI 客户端实例
     - model: 模型名称，例如 "chatgpt-4o-latest"、"gpt-4"、"gpt-3.5-turbo"
     - messages: Chat API 的消息列表，格式同 OpenAI SDK 要求
-    - temperature: 生成随机性参数
-    - max_tokens: 最大 token 数
+    - temperature: 生成随机性参数，为 None 时使用模型默认值
+    - max_tokens: 最大 token 数，为 None 时使用模型默认值
+    - coalesce: 是否与并发的相同请求合并为一次上游调用
 
     返回：
     - 完整的文本响应
     """
-    response = client.chat.completions.create(
+    params = _params(temperature, max_tokens)
+
+    def call():
+        response = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            **params
+        )
+        return response.choices[0].message.content
+
+    if not coalesce:
+        return call()
+    return _flights.do(request_key(model, messages, credential=_credential(client), **params), call)
+
+
+def _stream_deltas(client: OpenAI, model: str, messages: list, params: dict):
+    stream = client.chat.completions.create(
         model=model,
         messages=messages,
-        temperature=temperature,
-        max_tokens=max_tokens
+        stream=True,
+        **params
     )
-    return response.choices[0].message.content
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        # 提前结束时关闭 HTTP 流，不再继续消耗 token
+        if hasattr(stream, "close"):
+            stream.close()
+
+
+def chat_completion_stream(client: OpenAI, model: str, messages: list, temperature: float = 0.7, max_tokens: int = 2048,
+                           coalesce: bool = True):
+    """
+    流式版本的 chat_completion，逐段 yield 文本增量，参数同 chat_completion。
+    合并时后加入的请求会先拿到已生成的部分，再继续跟随同一个上游流。
+    """
+    params = _params(temperature, max_tokens)
+    if not coalesce:
+        yield from _stream_deltas(client, model, messages, params)
+        return
+    key = request_key(model, messages, stream=True, credential=_credential(client), **params)
+    yield from _flights.stream(key, lambda: _stream_deltas(client, model, messages, params))
+
+
+async def async_chat_completion(client: AsyncOpenAI, model: str, messages: list, temperature: float = 0.7, max_tokens: int = 2048,
+                                coalesce: bool = True):
+    """
+    异步版本的 chat_completion，参数与返回值同 chat_completion。
+    """
+    params = _params(temperature, max_tokens)
+
+    async def call():
+        response = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            **params
+        )
+        return response.choices[0].message.content
+
+    if not coalesce:
+        return await call()
+    return await _async_flights.do(request_key(model, messages, credential=_credential(client), **params), call)
+
+
+async def _async_stream_deltas(client: AsyncOpenAI, model: str, messages: list, params: dict):
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        **params
+    )
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        if hasattr(stream, "aclose"):
+            await stream.aclose()
+        elif hasattr(stream, "close"):
+            await stream.close()
+
+
+async def async_chat_completion_stream(client: AsyncOpenAI, model: str, messages: list, temperature: float = 0.7, max_tokens: int = 2048,
+                                       coalesce: bool = True):
+    """
+    异步流式版本，逐段 yield 文本增量。
+    """
+    params = _params(temperature, max_tokens)
+    if not coalesce:
+        async for delta in _async_stream_deltas(client, model, messages, params):
+            yield delta
+        return
+    key = request_key(model, messages, stream=True, credential=_credential(client), **params)
+    async for delta in _async_flights.stream(key, lambda: _async_stream_deltas(client, model, messages, params)):
+        yield delta
@@ -0,0 +1,109 @@
+# 文件：utils/job_runner.py
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    """
+    一个后台任务的状态。任务函数通过 append / set_section 写入中间结果，页面轮询读取。
+
+    - status: "running"、"done" 或 "error"
+    - text: 流式任务已生成的文本
+    - sections: 分段任务已完成的各段，{下标: 文本}
+    - result: 任务函数的返回值（文本、音频字节、图片地址等）
+    - meta: 页面展示所需的附加信息，任务函数也可以写入（如是否命中缓存）
+    """
+
+    def __init__(self, kind: str, meta: dict = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "running"
+        self.text = ""
+        self.sections = {}
+        self.result = None
+        self.error = None
+        self.meta = dict(meta or {})
+        self.created = time.time()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    @property
+    def done(self) -> bool:
+        return self.status != "running"
+
+    def append(self, delta: str):
+        with self._lock:
+            self.text += delta
+
+    def set_section(self, index: int, text: str):
+        with self._lock:
+            self.sections[index] = text
+
+
+class JobRunner:
+    """
+    用线程池执行耗时的生成任务，任务不依附于某一次 Streamlit 脚本运行：
+    页面重跑时凭会话中保存的任务 ID 重新取回任务，无需重新请求。
+
+    - max_workers: 线程池大小
+    - ttl: 任务结束后结果保留的秒数
+    """
+
+    def __init__(self, max_workers: int = 16, ttl: float = 1800):
+        self.ttl = ttl
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, fn, *args, meta: dict = None, **kwargs) -> str:
+        """
+        提交任务并返回任务 ID；fn 的第一个参数为 Job，其返回值写入 job.result。
+        """
+        job = Job(kind, meta)
+        with self._lock:
+            self._purge_locked()
+            self._jobs[job.id] = job
+        self._pool.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def submit_stream(self, kind: str, stream_factory, *args, meta: dict = None, **kwargs) -> str:
+        """
+        提交流式文本任务：逐段写入 job.text，结束后 job.result 为完整文本。
+
+        - stream_factory: 返回文本增量可迭代对象的函数，在后台线程中调用
+        """
+        def consume(job):
+            for delta in stream_factory(*args, **kwargs):
+                job.append(delta)
+            return job.text
+
+        return self.submit(kind, consume, meta=meta)
+
+    def get(self, job_id: str):
+        """
+        按 ID 取回任务；不存在或已过期时返回 None。
+        """
+        if not job_id:
+            return None
+        with self._lock:
+            self._purge_locked()
+            return self._jobs.get(job_id)
+
+    def _run(self, job: Job, fn, args, kwargs):
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = "done"
+        except Exception as exc:
+            job.error = exc
+            job.status = "error"
+        finally:
+            job.finished = time.time()
+
+    def _purge_locked(self):
+        now = time.time()
+        expired = [jid for jid, job in self._jobs.items() if job.finished and now - job.finished > self.ttl]
+        for jid in expired:
+            del self._jobs[jid]
@@ -0,0 +1,409 @@
+# 文件：utils/key_pool.py
+
+import asyncio
+import os
+import threading
+import time
+
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APIStatusError
+
+# 服务端 Key 池配置：OPENAI_API_KEYS 用逗号分隔多个 Key，或 OPENAI_KEY_POOL_FILE 指向每行一个 Key 的文件
+_POOL_ENV = "OPENAI_API_KEYS"
+_POOL_FILE_ENV = "OPENAI_KEY_POOL_FILE"
+
+# 429 / 5xx 后默认冷却秒数；响应带 Retry-After 时以其为准
+DEFAULT_COOLDOWN = 30.0
+
+
+def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, APIConnectionError):
+        return True
+    return isinstance(exc, APIStatusError) and (exc.status_code == 429 or exc.status_code >= 500)
+
+
+def _retry_after(exc: Exception):
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(kwargs: dict) -> int:
+    """
+    粗略估算一次请求会占用的 token 数（提示按约 2 字符 / token 计，再加上生成上限），仅用于负载均衡。
+    """
+    prompt = kwargs.get("messages") or kwargs.get("input") or kwargs.get("prompt") or ""
+    limit = kwargs.get("max_tokens") or kwargs.get("max_completion_tokens") or 0
+    return len(str(prompt)) // 2 + int(limit)
+
+
+class _KeyState:
+    def __init__(self, key: str):
+        self.key = key
+        self.outstanding = 0
+        self.cooldown_until = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.tokens_used = 0
+        self._client = None
+        self._async_clients = {}
+        self._async_lock = threading.Lock()
+
+    @property
+    def label(self) -> str:
+        return f"{self.key[:7]}…{self.key[-4:]}"
+
+    @property
+    def client(self) -> OpenAI:
+        # 失败时由 Key 池切换到下一个 Key，因此关闭 SDK 自带的重试
+        if self._client is None:
+            self._client = OpenAI(api_key=self.key, max_retries=0)
+        return self._client
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        # 异步客户端的连接绑定在创建它的事件循环上，循环关闭后保活连接即失效；
+        # 因此按事件循环各建一个客户端。正常情况下由 AsyncPooledOpenAI.close() 在循环结束前关闭，
+        # 这里再丢弃遗留的已关闭循环的客户端（其循环已不存在，无法再 await 关闭）
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            for closed in [l for l in self._async_clients if l.is_closed()]:
+                del self._async_clients[closed]
+            if loop not in self._async_clients:
+                self._async_clients[loop] = AsyncOpenAI(api_key=self.key, max_retries=0)
+            return self._async_clients[loop]
+
+    async def aclose_loop_client(self):
+        """
+        关闭当前事件循环对应的异步客户端。
+        """
+        with self._async_lock:
+            client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
+
+
+class KeyPool:
+    """
+    多个 OpenAI API Key 组成的池：按“未完成请求的预估 token 数”最少选 Key，
+    遇到 429 / 5xx / 连接错误时冷却该 Key 并自动换下一个 Key 重试。
+
+    - keys: API Key 列表
+    - cooldown: 没有 Retry-After 时的默认冷却秒数
+    """
+
+    def __init__(self, keys: list, cooldown: float = DEFAULT_COOLDOWN):
+        if not keys:
+            raise ValueError("Key 池至少需要一个 API Key")
+        self.cooldown = cooldown
+        self._states = [_KeyState(k) for k in dict.fromkeys(keys)]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    async def aclose_loop_clients(self):
+        """
+        关闭各 Key 在当前事件循环中创建的异步客户端；在 asyncio.run 等临时事件循环结束前调用。
+        """
+        for state in self._states:
+            await state.aclose_loop_client()
+
+    def acquire(self, estimated_tokens: int, exclude=()) -> _KeyState:
+        """
+        选出负载最轻的可用 Key；全部处于冷却时选最早结束冷却的 Key。
+        """
+        with self._lock:
+            now = time.time()
+            candidates = [s for s in self._states if s not in exclude] or self._states
+            ready = [s for s in candidates if s.cooldown_until <= now]
+            if ready:
+                state = min(ready, key=lambda s: s.outstanding)
+            else:
+                state = min(candidates, key=lambda s: s.cooldown_until)
+            state.outstanding += estimated_tokens
+            state.requests += 1
+            return state
+
+    def release(self, state: _KeyState, estimated_tokens: int, used_tokens: int = None, error: Exception = None):
+        with self._lock:
+            state.outstanding -= estimated_tokens
+            state.tokens_used += used_tokens if used_tokens is not None else 0
+            if error is not None:
+                state.failures += 1
+                if _is_retryable(error):
+                    state.cooldown_until = time.time() + (_retry_after(error) or self.cooldown)
+
+    def stats(self) -> list:
+        """
+        各 Key 的用量（Key 已脱敏），供页面与 /v1/keys 展示。
+        """
+        with self._lock:
+            now = time.time()
+            return [
+                {
+                    "key": s.label,
+                    "requests": s.requests,
+                    "failures": s.failures,
+                    "tokens_used": s.tokens_used,
+                    "outstanding_tokens": s.outstanding,
+                    "cooldown_seconds": max(0, round(s.cooldown_until - now)),
+                }
+                for s in self._states
+            ]
+
+    def call(self, path: tuple, args: tuple, kwargs: dict):
+        """
+        在选中的 Key 上调用 client.<path>(*args, **kwargs)，可重试错误时换 Key，最多把每个 Key 各试一次。
+        """
+        kwargs = _with_stream_usage(path, kwargs)
+        estimated = estimate_tokens(kwargs)
+        tried = []
+        while True:
+            state = self.acquire(estimated, exclude=tried)
+            try:
+                result = _resolve(state.client, path)(*args, **kwargs)
+            except Exception as exc:
+                self.release(state, estimated, error=exc)
+                tried.append(state)
+                if _is_retryable(exc) and len(tried) < len(self._states):
+                    continue
+                raise
+            if kwargs.get("stream"):
+                return _PooledStream(self, state, estimated, result)
+            self.release(state, estimated, _usage(result))
+            return result
+
+    async def acall(self, path: tuple, args: tuple, kwargs: dict):
+        """
+        call 的异步版本，在各 Key 的 AsyncOpenAI 客户端上执行。
+        """
+        kwargs = _with_stream_usage(path, kwargs)
+        estimated = estimate_tokens(kwargs)
+        tried = []
+        while True:
+            state = self.acquire(estimated, exclude=tried)
+            try:
+                result = await _resolve(state.async_client, path)(*args, **kwargs)
+            except Exception as exc:
+                self.release(state, estimated, error=exc)
+                tried.append(state)
+                if _is_retryable(exc) and len(tried) < len(self._states):
+                    continue
+                raise
+            if kwargs.get("stream"):
+                return _AsyncPooledStream(self, state, estimated, result)
+            self.release(state, estimated, _usage(result))
+            return result
+
+
+class _PooledStream:
+    """
+    包装 SDK 的 Stream：读完、出错、被 close() 或被丢弃（即使一个片段都没读）时，
+    关闭上游 HTTP 流并把该请求从 Key 的未完成量中扣除。
+    用量取自末尾带 usage 的片段，拿不到时按预估值记账。
+    """
+
+    def __init__(self, pool: KeyPool, state: _KeyState, estimated: int, stream):
+        self._pool = pool
+        self._state = state
+        self._estimated = estimated
+        self._stream = stream
+        self._iter = None
+        self._used = None
+        self._released = False
+
+    def __getattr__(self, name):
+        # response 等其余属性直接取自原始流；私有属性不转发，避免初始化失败时析构递归
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._stream, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._iter is None:
+            self._iter = iter(self._stream)
+        try:
+            chunk = next(self._iter)
+        except StopIteration:
+            self.close()
+            raise
+        except Exception as exc:
+            self._release(exc)
+            self._stream.close()
+            raise
+        self._used = _usage(chunk) or self._used
+        return chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def _release(self, error: Exception = None) -> bool:
+        if self._released:
+            return False
+        self._released = True
+        used = self._used if self._used is not None else self._estimated
+        self._pool.release(self._state, self._estimated, used, error=error)
+        return True
+
+    def close(self):
+        if self._release():
+            self._stream.close()
+
+
+class _AsyncPooledStream(_PooledStream):
+    """
+    _PooledStream 的异步版本，包装 AsyncStream。
+    """
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._iter is None:
+            self._iter = self._stream.__aiter__()
+        try:
+            chunk = await self._iter.__anext__()
+        except StopAsyncIteration:
+            await self.close()
+            raise
+        except Exception as exc:
+            self._release(exc)
+            await self._stream.close()
+            raise
+        self._used = _usage(chunk) or self._used
+        return chunk
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def __del__(self):
+        # 析构时无法 await 关闭上游流，至少归还 Key 的未完成量；连接随流对象回收
+        self._release()
+
+    async def close(self):
+        if self._release():
+            await self._stream.close()
+
+    aclose = close
+
+
+def _resolve(client, path: tuple):
+    target = client
+    for name in path:
+        target = getattr(target, name)
+    return target
+
+
+def _usage(result):
+    usage = getattr(result, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+
+def _with_stream_usage(path: tuple, kwargs: dict) -> dict:
+    # 流式聊天默认不返回用量，经 Key 池的请求统一要求末尾附带 usage 片段，便于按 Key 统计
+    if path != ("chat", "completions", "create") or not kwargs.get("stream") or "stream_options" in kwargs:
+        return kwargs
+    return {**kwargs, "stream_options": {"include_usage": True}}
+
+
+class _PooledAttr:
+    """
+    记录属性访问路径（如 chat.completions.create），调用时交给 Key 池执行。
+    """
+
+    def __init__(self, pool: KeyPool, path: tuple, is_async: bool, timeout: float = None):
+        self._pool = pool
+        self._path = path
+        self._async = is_async
+        self._timeout = timeout
+
+    def __getattr__(self, name):
+        # 私有属性与 __deepcopy__ 等协议方法不走代理
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return _PooledAttr(self._pool, self._path + (name,), self._async, self._timeout)
+
+    def __call__(self, *args, **kwargs):
+        # 代理上设置的超时作为单次请求的 timeout 传给 SDK，调用方显式传入时以调用方为准
+        if self._timeout is not None:
+            kwargs.setdefault("timeout", self._timeout)
+        if self._async:
+            return self._pool.acall(self._path, args, kwargs)
+        return self._pool.call(self._path, args, kwargs)
+
+
+class PooledOpenAI(_PooledAttr):
+    """
+    与 OpenAI 客户端用法一致的代理，例如 client.chat.completions.create(...)，
+    每次调用由 Key 池选择 Key 并在失败时切换。
+    """
+
+    def __init__(self, pool: KeyPool, timeout: float = None):
+        super().__init__(pool, (), False, timeout)
+        self.pool = pool
+
+
+class AsyncPooledOpenAI(_PooledAttr):
+    """
+    与 AsyncOpenAI 客户端用法一致的代理。
+
+    - timeout: 每次请求的超时秒数，为 None 时使用 SDK 默认值
+    """
+
+    def __init__(self, pool: KeyPool, timeout: float = None):
+        super().__init__(pool, (), True, timeout)
+        self.pool = pool
+
+    async def close(self):
+        # 与 AsyncOpenAI.close() 对应：关闭 Key 池在当前事件循环中的客户端，其他循环的客户端不受影响
+        await self.pool.aclose_loop_clients()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def load_keys() -> list:
+    """
+    从 OPENAI_API_KEYS 或 OPENAI_KEY_POOL_FILE 读取 Key 列表；文件中以 # 开头的行视为注释。
+    """
+    keys = [k.strip() for k in os.getenv(_POOL_ENV, "").split(",") if k.strip()]
+    path = os.getenv(_POOL_FILE_ENV)
+    if path and os.path.isfile(path):
+        with open(path, encoding="utf-8") as f:
+            keys.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+    return keys
+
+
+def get_key_pool():
+    """
+    返回进程内共享的 Key 池；未配置时返回 None。
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            keys = load_keys()
+            if keys:
+                _pool = KeyPool(keys, cooldown=float(os.getenv("OPENAI_KEY_COOLDOWN", DEFAULT_COOLDOWN)))
+        return _pool
@@ -1,6 +1,7 @@
 # 文件：utils/markdown_parser.py
 
 import re
+from xml.sax.saxutils import escape
 from reportlab.platypus import Paragraph, ListFlowable, ListItem, Spacer
 from reportlab.lib.enums import TA_LEFT
 
@@ -19,7 +20,20 @@ def markdown_to_flowables(
     - "- "  无序列表  → 用 normal_style 生成 ListFlowable
     - 其余段落     → 用 normal_style，支持 **粗体** 转换
     """
-    flowables = []
+    return list(iter_markdown_flowables(markdown_text, normal_style, h1_style, h2_style, h3_style))
+
+
+def iter_markdown_flowables(
+        markdown_text: str,
+        normal_style,
+        h1_style,
+        h2_style,
+        h3_style
+    ):
+    """
+    markdown_to_flowables 的生成器版本，逐个产出 Flowable，供分批构建长文档使用。
+    文本中的 <、>、& 会先转义，避免聊天内容（如代码）被 ReportLab 当作标记解析。
+    """
     lines = markdown_text.split('\n')
     i = 0
 
@@ -28,41 +42,39 @@ def markdown_to_flowables(
     while i < len(lines):
         line = lines[i].rstrip()
         if not line.strip():
-            flowables.append(Spacer(1, 6))
+            yield Spacer(1, 6)
             i += 1
             continue
 
         if line.startswith('# '):
-            text = line[2:].strip()
-            flowables.append(Paragraph(text, h1_style))
+            text = escape(line[2:].strip())
+            yield Paragraph(text, h1_style)
             i += 1
             continue
 
         if line.startswith('## '):
-            text = line[3:].strip()
-            flowables.append(Paragraph(text, h2_style))
+            text = escape(line[3:].strip())
+            yield Paragraph(text, h2_style)
             i += 1
             continue
 
         if line.startswith('### '):
-            text = line[4:].strip()
-            flowables.append(Paragraph(text, h3_style))
+            text = escape(line[4:].strip())
+            yield Paragraph(text, h3_style)
             i += 1
             continue
 
         if line.startswith('- '):
             bullet_items = []
             while i < len(lines) and lines[i].lstrip().startswith('- '):
-                item_text = lines[i].lstrip()[2:].strip()
+                item_text = escape(lines[i].lstrip()[2:].strip())
                 item_html = bold_pattern.sub(r'<b>\1</b>', item_text)
                 p = Paragraph(item_html, normal_style)
                 bullet_items.append(ListItem(p, leftIndent=12))
                 i += 1
-            flowables.append(ListFlowable(bullet_items, bulletType='bullet', leftIndent=12))
+            yield ListFlowable(bullet_items, bulletType='bullet', leftIndent=12)
             continue
 
-        paragraph_html = bold_pattern.sub(r'<b>\1</b>', line)
-        flowables.append(Paragraph(paragraph_html, normal_style))
+        paragraph_html = bold_pattern.sub(r'<b>\1</b>', escape(line))
+        yield Paragraph(paragraph_html, normal_style)
         i += 1
-
-    return flowables
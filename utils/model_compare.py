@@ -0,0 +1,107 @@
+# 文件：utils/model_compare.py
+
+import asyncio
+import time
+
+from openai import AsyncOpenAI
+
+# 不走 Chat Completions 接口的模型名片段（语音、图像、补全、实时等）
+_NON_CHAT_MARKERS = (
+    "tts", "transcribe", "audio", "realtime", "image", "dall-e", "whisper",
+    "instruct", "embedding", "moderation", "search", "deep-research", "-pro",
+)
+
+
+def is_chat_model(mid: str) -> bool:
+    """
+    可以参与对比的聊天模型：GPT / ChatGPT / o 系列，排除语音、图像等专用模型。
+    """
+    return mid.startswith(("gpt-", "chatgpt-", "o1", "o3", "o4")) and not any(m in mid for m in _NON_CHAT_MARKERS)
+
+
+def is_reasoning_model(mid: str) -> bool:
+    """
+    推理模型不接受 temperature，生成上限用 max_completion_tokens 表示。
+    """
+    return mid.startswith(("o1", "o3", "o4", "gpt-5"))
+
+
+def _model_params(model: str, temperature, max_tokens) -> dict:
+    if is_reasoning_model(model):
+        params = {"max_completion_tokens": max_tokens}
+    else:
+        params = {"temperature": temperature, "max_tokens": max_tokens}
+    return {k: v for k, v in params.items() if v is not None}
+
+
+class CompareResult:
+    """
+    单个模型在对比中的结果与耗时指标。
+
+    - ttft: 首个文本片段到达的耗时（秒）
+    - latency: 整个回答完成的耗时（秒）
+    - prompt_tokens / completion_tokens: 接口返回的 token 用量，拿不到时为 None
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.text = ""
+        self.ttft = None
+        self.latency = None
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.error = None
+        self.done = False
+
+    @property
+    def tokens_per_second(self):
+        if not self.completion_tokens or not self.latency:
+            return None
+        return self.completion_tokens / self.latency
+
+
+async def _run_one(client: AsyncOpenAI, result: CompareResult, messages: list, params: dict, on_update):
+    start = time.perf_counter()
+    try:
+        stream = await client.chat.completions.create(
+            model=result.model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **params
+        )
+        async for chunk in stream:
+            if chunk.usage:
+                result.prompt_tokens = chunk.usage.prompt_tokens
+                result.completion_tokens = chunk.usage.completion_tokens
+            if chunk.choices and chunk.choices[0].delta.content:
+                if result.ttft is None:
+                    result.ttft = time.perf_counter() - start
+                result.text += chunk.choices[0].delta.content
+                on_update(result)
+    except Exception as exc:
+        result.error = exc
+    finally:
+        result.latency = time.perf_counter() - start
+        result.done = True
+        on_update(result)
+
+
+async def compare_models(client: AsyncOpenAI, models: list, messages: list,
+                         temperature: float = 0.7, max_tokens: int = 2048, on_update=None) -> list:
+    """
+    把同一组消息并发发给多个模型，流式收集各自的回答与耗时指标。
+
+    - on_update: 每收到一个片段（以及每个模型结束时）调用 on_update(CompareResult)
+    - 推理模型（o 系列）不发送 temperature，max_tokens 以 max_completion_tokens 发送
+    - 单个模型出错不影响其他模型，错误记录在对应结果的 error 中
+
+    返回：
+    - 与 models 顺序一致的 CompareResult 列表
+    """
+    results = [CompareResult(m) for m in models]
+    await asyncio.gather(*(
+        _run_one(client, r, messages, _model_params(r.model, temperature, max_tokens), on_update or (lambda r: None))
+        for r in results
+    ))
+    return results
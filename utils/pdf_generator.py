@@ -1,7 +1,9 @@
 # 文件：utils/pdf_generator.py
 
 import os
+import tempfile
 from io import BytesIO
+from xml.sax.saxutils import escape
 from reportlab.lib.pagesizes import A4
 from reportlab.platypus import SimpleDocTemplate, Spacer, Paragraph, ListFlowable, ListItem
 from reportlab.lib.units import mm
@@ -10,7 +12,7 @@ from reportlab.pdfbase.ttfonts import TTFont, TTFError
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_LEFT
 
-from .markdown_parser import markdown_to_flowables
+from .markdown_parser import markdown_to_flowables, iter_markdown_flowables
 
 # ----------------------------------------------------------------
 # 1. 动态加载“项目自带的”中文字体 NotoSansCJKsc-Regular.otf
@@ -31,33 +33,15 @@ if os.path.isfile(_font_path):
         FONT_NAME = 'Helvetica'
 
 
-def generate_pdf_from_markdown(title: str, info_lines: list, markdown_content: str) -> bytes:
+# ----------------------------------------------------------------
+# 2. 根据 FONT_NAME 动态定义各级样式
+# ----------------------------------------------------------------
+def _build_styles() -> dict:
     """
-    使用 ReportLab 根据传入的标题、个人信息行和 Markdown 内容生成 PDF 字节。
-
-    - title: 文档标题，例如 "个人八字运势报告" 或 "两人星宿配对报告"
-    - info_lines: 个人信息列表，例如 ["生成日期：2025年06月01日", "姓名：张三    性别：男    出生：2000年01月01日 03时00分"]
-    - markdown_content: 完整的 Markdown 文本，由 ChatGPT 输出
-
-    返回：
-    - PDF 对应的二进制字节数组，可直接给 st.download_button 使用
+    根据 FONT_NAME 动态定义各级样式，单次导出与分批导出共用。
     """
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(
-        buffer,
-        pagesize=A4,
-        leftMargin=20 * mm,
-        rightMargin=20 * mm,
-        topMargin=20 * mm,
-        bottomMargin=20 * mm
-    )
-
     styles = getSampleStyleSheet()
-    story = []
 
-    # ----------------------------------------------------------------
-    # 2. 根据 FONT_NAME 动态定义各级样式
-    # ----------------------------------------------------------------
     title_style = ParagraphStyle(
         name='Title',
         parent=styles['Title'],
@@ -111,16 +95,55 @@ def generate_pdf_from_markdown(title: str, info_lines: list, markdown_content: s
         spaceAfter=6,
         alignment=TA_LEFT
     )
+    return {
+        'title': title_style,
+        'info': info_style,
+        'h1': h1_style,
+        'h2': h2_style,
+        'h3': h3_style,
+        'normal': normal_style,
+    }
+
+
+def generate_pdf_from_markdown(title: str, info_lines: list, markdown_content: str) -> bytes:
+    """
+    使用 ReportLab 根据传入的标题、个人信息行和 Markdown 内容生成 PDF 字节。
+
+    - title: 文档标题，例如 "个人八字运势报告" 或 "两人星宿配对报告"
+    - info_lines: 个人信息列表，例如 ["生成日期：2025年06月01日", "姓名：张三    性别：男    出生：2000年01月01日 03时00分"]
+    - markdown_content: 完整的 Markdown 文本，由 ChatGPT 输出
+
+    返回：
+    - PDF 对应的二进制字节数组，可直接给 st.download_button 使用
+    """
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=A4,
+        leftMargin=20 * mm,
+        rightMargin=20 * mm,
+        topMargin=20 * mm,
+        bottomMargin=20 * mm
+    )
+
+    styles = _build_styles()
+    title_style = styles['title']
+    info_style = styles['info']
+    h1_style = styles['h1']
+    h2_style = styles['h2']
+    h3_style = styles['h3']
+    normal_style = styles['normal']
+    story = []
 
     # ----------------------------------------------------------------
     # 3. 先插入“标题”和“个人信息”部分
     # ----------------------------------------------------------------
-    story.append(Paragraph(title, title_style))
+    story.append(Paragraph(escape(title), title_style))
     story.append(Spacer(1, 6))
 
     for line in info_lines:
         # 用 <br/> 支持换行
-        story.append(Paragraph(line.replace('\n', '<br/>'), info_style))
+        story.append(Paragraph(escape(line).replace('\n', '<br/>'), info_style))
     story.append(Spacer(1, 12))
 
     # ----------------------------------------------------------------
@@ -142,3 +165,115 @@ def generate_pdf_from_markdown(title: str, info_lines: list, markdown_content: s
     pdf_bytes = buffer.getvalue()
     buffer.close()
     return pdf_bytes
+
+
+class _StoryFeed(list):
+    """
+    按需补充的 story：ReportLab 每排版一个 Flowable 就从列表头部删除一个，
+    这里在列表变短时才从 chunks 中取下一批，内存中只保留少量待排版的 Flowable。
+    """
+
+    def __init__(self, chunks, low_water: int = 64):
+        super().__init__()
+        self._chunks = iter(chunks)
+        self._low_water = low_water
+
+    def _fill(self):
+        while self._chunks is not None and list.__len__(self) < self._low_water:
+            try:
+                self.extend(next(self._chunks))
+            except StopIteration:
+                self._chunks = None
+
+    def __len__(self):
+        self._fill()
+        return list.__len__(self)
+
+    def __getitem__(self, index):
+        self._fill()
+        return list.__getitem__(self, index)
+
+
+def write_pdf_from_sections(path: str, title: str, info_lines: list, sections) -> str:
+    """
+    把多段 Markdown 逐段排版写入 path 指向的 PDF 文件，适合长聊天记录或批量报告。
+
+    - sections: 可迭代的 (小标题, Markdown 文本) 序列，可以是生成器；小标题为空时不输出标题
+
+    与 generate_pdf_from_markdown 不同，这里不会一次性构建完整 story，
+    也不经过 BytesIO，而是直接写入磁盘文件。
+
+    返回：
+    - path
+    """
+    styles = _build_styles()
+    doc = SimpleDocTemplate(
+        path,
+        pagesize=A4,
+        leftMargin=20 * mm,
+        rightMargin=20 * mm,
+        topMargin=20 * mm,
+        bottomMargin=20 * mm
+    )
+
+    def chunks():
+        # 标题、信息行与小标题中的姓名等可能含 < & 等字符，先转义再交给 Paragraph
+        header = [Paragraph(escape(title), styles['title']), Spacer(1, 6)]
+        for line in info_lines:
+            header.append(Paragraph(escape(line).replace('\n', '<br/>'), styles['info']))
+        header.append(Spacer(1, 12))
+        yield header
+        for heading, markdown_content in sections:
+            if heading:
+                yield [Paragraph(escape(heading), styles['h2'])]
+            batch = []
+            for flowable in iter_markdown_flowables(
+                markdown_content,
+                normal_style=styles['normal'],
+                h1_style=styles['h1'],
+                h2_style=styles['h2'],
+                h3_style=styles['h3']
+            ):
+                batch.append(flowable)
+                if len(batch) >= 32:
+                    yield batch
+                    batch = []
+            batch.append(Spacer(1, 12))
+            yield batch
+
+    doc.build(_StoryFeed(chunks()))
+    return path
+
+
+def export_pdf_to_tempfile(title: str, info_lines: list, sections) -> str:
+    """
+    调用 write_pdf_from_sections 写入一个临时 PDF 文件并返回其路径，用完后由调用方删除。
+    """
+    fd, path = tempfile.mkstemp(prefix='export_', suffix='.pdf')
+    os.close(fd)
+    try:
+        return write_pdf_from_sections(path, title, info_lines, sections)
+    except Exception:
+        os.remove(path)
+        raise
+
+
+def chat_sections(messages: list):
+    """
+    把 Streamlit 会话中的消息列表转换为 write_pdf_from_sections 所需的 (小标题, Markdown) 序列。
+    PDF 附件与图片只记录文件名 / 占位，不把全文重复写入导出文件。
+    """
+    role_names = {'user': '用户', 'assistant': '助手', 'system': '系统'}
+    for msg in messages:
+        content = msg['content']
+        if isinstance(content, list):
+            texts = []
+            for part in content:
+                if part.get('filename'):
+                    texts.append(f"- 附件：{part['filename']}")
+                elif part.get('type') == 'image_url':
+                    texts.append('- [图片]')
+                else:
+                    texts.append(part.get('text', ''))
+            content = '\n'.join(texts)
+        yield role_names.get(msg['role'], msg['role']), content
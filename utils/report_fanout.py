@@ -0,0 +1,81 @@
+# 文件：utils/report_fanout.py
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from openai import OpenAI, AsyncOpenAI
+
+from .bazi_prompts import PERSONAL_SECTION_GROUPS, build_chart_messages, build_section_messages
+from .chatgpt_client import chat_completion, async_chat_completion
+
+# 排盘只需列出四柱与大运，给一个较小的上限即可
+CHART_MAX_TOKENS = 400
+
+
+def _failed_section(index: int, exc: Exception) -> str:
+    # 单个分组失败时占位，其余分组照常输出、照常导出
+    return f"> ⚠️ {PERSONAL_SECTION_GROUPS[index][0]} 生成失败：{exc}"
+
+
+def personal_report_fanout(client: OpenAI, model: str, name: str, gender: str, birth_text: str,
+                           today: str = None, temperature: float = 0.7, max_tokens: int = 1536):
+    """
+    分段并行生成个人运势报告（同步版，供 Streamlit 页面使用）。
+
+    先用一次简短请求排盘，再把各章节分组作为并发请求同时发出，每组单独享有 max_tokens，
+    整体耗时约等于“排盘 + 最慢的一组”，也不会因为总长度超过单次上限而被截断。
+
+    生成器，按完成先后 yield (分组下标, 分组 Markdown)；调用方按下标归位即可保持章节顺序。
+    """
+    chart = chat_completion(
+        client, model, build_chart_messages(name, gender, birth_text, today),
+        temperature=0.2, max_tokens=CHART_MAX_TOKENS
+    )
+    with ThreadPoolExecutor(max_workers=len(PERSONAL_SECTION_GROUPS)) as pool:
+        futures = {
+            pool.submit(
+                chat_completion, client, model,
+                build_section_messages(i, name, gender, birth_text, chart, today),
+                temperature, max_tokens
+            ): i
+            for i in range(len(PERSONAL_SECTION_GROUPS))
+        }
+        for future in as_completed(futures):
+            try:
+                text = future.result()
+            except Exception as exc:
+                text = _failed_section(futures[future], exc)
+            yield futures[future], text
+
+
+async def async_personal_report_fanout(client: AsyncOpenAI, model: str, name: str, gender: str, birth_text: str,
+                                       today: str = None, temperature: float = 0.7, max_tokens: int = 1536):
+    """
+    分段并行生成个人运势报告（异步版，供 HTTP 服务使用）。
+
+    异步生成器，按章节顺序 yield 各分组 Markdown：前面的分组一完成就立即输出，
+    后面的分组此时通常也已生成完毕。
+    """
+    chart = await async_chat_completion(
+        client, model, build_chart_messages(name, gender, birth_text, today),
+        temperature=0.2, max_tokens=CHART_MAX_TOKENS
+    )
+    tasks = [
+        asyncio.ensure_future(async_chat_completion(
+            client, model,
+            build_section_messages(i, name, gender, birth_text, chart, today),
+            temperature, max_tokens
+        ))
+        for i in range(len(PERSONAL_SECTION_GROUPS))
+    ]
+    try:
+        for i, task in enumerate(tasks):
+            try:
+                text = await task
+            except Exception as exc:
+                text = _failed_section(i, exc)
+            yield (text + "\n\n") if i < len(tasks) - 1 else text
+    finally:
+        # 客户端断开或某一组失败时，取消尚未完成的分组，避免白白消耗额度
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,125 @@
+# 文件：utils/retrieval.py
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from openai import OpenAI
+
+from .semantic_cache import EMBEDDING_MODEL
+
+# Embedding 接口单次请求最多提交的文本条数
+_EMBED_BATCH = 256
+
+
+def document_hash(raw: bytes) -> str:
+    """
+    以文件内容的 SHA-256 作为文档标识，同一份 PDF 重复上传不会重复切分与 Embedding。
+    """
+    return hashlib.sha256(raw).hexdigest()
+
+
+def chunk_text(text: str, chunk_chars: int = 800, overlap: int = 100) -> list:
+    """
+    把长文本切成约 chunk_chars 字的片段：优先按段落拼接，超长段落再按定长切开，
+    相邻片段保留 overlap 字重叠，避免关键句被切断。
+    """
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+    chunks = []
+    current = ""
+    for para in paragraphs:
+        if len(current) + len(para) + 1 <= chunk_chars:
+            current = f"{current}\n{para}" if current else para
+            continue
+        if current:
+            chunks.append(current)
+        sliced = len(para) > chunk_chars
+        while len(para) > chunk_chars:
+            chunks.append(para[:chunk_chars])
+            para = para[chunk_chars - overlap:]
+        # 切开的长段落剩余部分已带有重叠，不再重复；否则在放得下时补上前一片段的结尾
+        if chunks and overlap and not sliced and len(para) + overlap + 1 <= chunk_chars:
+            current = chunks[-1][-overlap:] + "\n" + para
+        else:
+            current = para
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def embed_texts(client: OpenAI, texts: list, model: str = EMBEDDING_MODEL) -> np.ndarray:
+    """
+    批量调用 Embedding 接口，返回按行归一化的 float32 矩阵。
+    """
+    rows = []
+    for start in range(0, len(texts), _EMBED_BATCH):
+        r = client.embeddings.create(model=model, input=texts[start:start + _EMBED_BATCH])
+        rows.extend(d.embedding for d in sorted(r.data, key=lambda d: d.index))
+    matrix = np.asarray(rows, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class DocumentIndex:
+    """
+    按文档哈希保存“片段 + 向量”的内存索引；向量以 float16 存储，检索时再提升为 float32。
+
+    - max_documents: 最多保留的文档数，超出后淘汰最久未使用的文档
+    """
+
+    def __init__(self, max_documents: int = 64, embedding_model: str = EMBEDDING_MODEL):
+        self.max_documents = max_documents
+        self.embedding_model = embedding_model
+        self._docs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, doc_hash: str) -> bool:
+        with self._lock:
+            return doc_hash in self._docs
+
+    def add_document(self, client: OpenAI, doc_hash: str, text: str, chunk_chars: int = 800):
+        """
+        切分并 Embedding 一份文档；已索引过的文档直接跳过。
+        """
+        if doc_hash in self:
+            return
+        chunks = chunk_text(text, chunk_chars=chunk_chars)
+        if not chunks:
+            return
+        vectors = embed_texts(client, chunks, self.embedding_model).astype(np.float16)
+        with self._lock:
+            self._docs[doc_hash] = (chunks, vectors)
+            while len(self._docs) > self.max_documents:
+                self._docs.popitem(last=False)
+
+    def search(self, client: OpenAI, question: str, doc_hashes: list, top_k: int = 5) -> list:
+        """
+        在指定文档中检索与问题最相关的 top_k 个片段。
+
+        返回：
+        - [(doc_hash, 片段序号, 片段文本, 相似度)]，按相似度从高到低排序
+        """
+        with self._lock:
+            docs = [(h, self._docs[h]) for h in doc_hashes if h in self._docs]
+            for h, _ in docs:
+                self._docs.move_to_end(h)
+        if not docs:
+            return []
+        query = embed_texts(client, [question], self.embedding_model)[0]
+        owners = []
+        scores = []
+        for h, (chunks, vectors) in docs:
+            scores.append(vectors.astype(np.float32) @ query)
+            owners.extend((h, i) for i in range(len(chunks)))
+        scores = np.concatenate(scores)
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        chunk_map = dict(docs)
+        return [
+            (owners[i][0], owners[i][1], chunk_map[owners[i][0]][0][owners[i][1]], float(scores[i]))
+            for i in top
+        ]
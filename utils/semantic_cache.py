@@ -0,0 +1,263 @@
+# 文件：utils/semantic_cache.py
+
+import atexit
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+import numpy as np
+from openai import OpenAI
+
+from .chatgpt_client import chat_completion
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+
+class _Namespace:
+    """
+    单个模型的缓存空间：一行一个已归一化的提示向量，另存对应的上下文哈希、提示与回答。
+    容量满后按“最近最少命中”原地覆盖，向量矩阵从不整体搬移。
+    """
+
+    def __init__(self, dim: int, capacity: int):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.contexts = np.zeros(capacity, dtype=np.int64)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.prompts = [None] * capacity
+        self.answers = [None] * capacity
+        self.size = 0
+
+    def search(self, vec: np.ndarray, context: int):
+        if self.size == 0:
+            return -1, 0.0
+        # 向量均已归一化，点积即余弦相似度；只在上下文完全一致的条目中比较
+        scores = self.vectors[:self.size] @ vec
+        scores[self.contexts[:self.size] != context] = -np.inf
+        idx = int(np.argmax(scores))
+        return idx, float(scores[idx])
+
+    def insert(self, vec: np.ndarray, context: int, prompt: str, answer: str):
+        if self.size < len(self.vectors):
+            idx = self.size
+            self.size += 1
+        else:
+            idx = int(np.argmin(self.last_used))
+        self.vectors[idx] = vec
+        self.contexts[idx] = context
+        self.prompts[idx] = prompt
+        self.answers[idx] = answer
+        self.last_used[idx] = time.time()
+
+
+class SemanticCache:
+    """
+    基于 Embedding 的语义缓存：提示语义相近（余弦相似度 ≥ threshold）时直接复用已存回答。
+
+    - threshold: 命中所需的最小余弦相似度
+    - max_entries: 每个模型命名空间最多保存的条目数，超出后按最近最少命中淘汰
+    - path: 持久化目录，为 None 时只保存在内存中
+    - persist_every: 每新增多少条写一次磁盘
+    """
+
+    def __init__(self, threshold: float = 0.92, max_entries: int = 2000, path: str = None,
+                 embedding_model: str = EMBEDDING_MODEL, persist_every: int = 20):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.path = path
+        self.embedding_model = embedding_model
+        self.persist_every = persist_every
+        self._spaces = {}
+        self._dirty = 0
+        self._lock = threading.Lock()
+        if path:
+            self.load()
+            # 退出时把尚未达到 persist_every 的新增条目也写入磁盘
+            atexit.register(self.save)
+
+    def embed(self, client: OpenAI, text: str) -> np.ndarray:
+        """
+        调用 Embedding 接口并返回归一化后的 float32 向量。
+        """
+        r = client.embeddings.create(model=self.embedding_model, input=text)
+        vec = np.asarray(r.data[0].embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def lookup(self, model: str, vec: np.ndarray, context: int = 0, threshold: float = None):
+        """
+        在 model 命名空间中、上下文哈希为 context 的条目里查找最相近的提示，命中时返回回答，否则返回 None。
+
+        - context: 之前对话轮次的哈希（见 cache_key），单轮提问为 0
+        - threshold: 覆盖实例默认的相似度阈值
+        """
+        threshold = self.threshold if threshold is None else threshold
+        with self._lock:
+            space = self._spaces.get(model)
+            if space is None:
+                return None
+            idx, score = space.search(vec, context)
+            if idx < 0 or score < threshold:
+                return None
+            space.last_used[idx] = time.time()
+            return space.answers[idx]
+
+    def store(self, model: str, prompt: str, vec: np.ndarray, answer: str, context: int = 0):
+        with self._lock:
+            space = self._spaces.get(model)
+            if space is None:
+                space = self._spaces[model] = _Namespace(len(vec), self.max_entries)
+            space.insert(vec, context, prompt, answer)
+            self._dirty += 1
+            if self.path and self._dirty >= self.persist_every:
+                self._save_locked()
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            self._save_locked()
+
+    def _save_locked(self):
+        os.makedirs(self.path, exist_ok=True)
+        for model, space in self._spaces.items():
+            base = os.path.join(self.path, _safe_name(model))
+            n = space.size
+            with _AtomicFile(base + ".npz", "wb", self.path) as f:
+                np.savez(f, vectors=space.vectors[:n], contexts=space.contexts[:n], last_used=space.last_used[:n])
+            with _AtomicFile(base + ".json", "w", self.path) as f:
+                json.dump({"model": model, "prompts": space.prompts[:n], "answers": space.answers[:n]},
+                          f, ensure_ascii=False)
+        self._dirty = 0
+    def load(self):
+        """
+        从 path 目录恢复各命名空间；文件缺失、损坏或彼此条数不一致的命名空间直接跳过。
+        """
+        if not self.path or not os.path.isdir(self.path):
+            return
+        with self._lock:
+            for fname in os.listdir(self.path):
+                if not fname.endswith(".json"):
+                    continue
+                try:
+                    model, space = self._load_namespace(os.path.join(self.path, fname[:-5]))
+                except Exception:
+                    continue
+                if space is not None:
+                    self._spaces[model] = space
+
+    def _load_namespace(self, base: str):
+        with open(base + ".json", encoding="utf-8") as f:
+            meta = json.load(f)
+        with np.load(base + ".npz") as arrays:
+            vectors = arrays["vectors"]
+            contexts = arrays["contexts"]
+            last_used = arrays["last_used"]
+        count = len(vectors)
+        if not (len(contexts) == len(last_used) == len(meta["prompts"]) == len(meta["answers"]) == count):
+            return None, None
+        n = min(count, self.max_entries)
+        if n == 0:
+            return None, None
+        # 超出 max_entries 时保留最近命中的条目
+        keep = np.argsort(last_used)[::-1][:n]
+        space = _Namespace(vectors.shape[1], self.max_entries)
+        space.vectors[:n] = vectors[keep]
+        space.contexts[:n] = contexts[keep]
+        space.last_used[:n] = last_used[keep]
+        space.prompts[:n] = [meta["prompts"][i] for i in keep]
+        space.answers[:n] = [meta["answers"][i] for i in keep]
+        space.size = n
+        return meta["model"], space
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {model: space.size for model, space in self._spaces.items()}
+
+
+class _AtomicFile:
+    """
+    先写同目录下的临时文件，写完再 os.replace 替换目标文件，进程中途退出也不会留下半截文件。
+    """
+
+    def __init__(self, target: str, mode: str, directory: str):
+        self.target = target
+        encoding = None if "b" in mode else "utf-8"
+        fd, self.tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        self.file = os.fdopen(fd, mode, encoding=encoding)
+
+    def __enter__(self):
+        return self.file
+
+    def __exit__(self, exc_type, exc, tb):
+        self.file.close()
+        if exc_type is None:
+            os.replace(self.tmp, self.target)
+        else:
+            os.remove(self.tmp)
+
+
+def _safe_name(model: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]", "_", model)
+
+
+def _message_text(msg: dict):
+    content = msg["content"]
+    if isinstance(content, list):
+        texts = []
+        for part in content:
+            if part.get("type") != "text" or part.get("filename"):
+                return None
+            texts.append(part["text"])
+        content = "\n".join(texts)
+    return f"{msg['role']}: {content}"
+
+
+def cache_key(messages: list):
+    """
+    把纯文本消息列表拆成 (上下文哈希, 用于 Embedding 的文本)；含图片、附件等非文本内容时返回 None，不参与缓存。
+
+    只对系统提示与最后一条用户消息做 Embedding，输入长度不随对话轮数增长；
+    之前的对话轮次取精确哈希作为上下文，只有上下文完全一致时才比较语义相似度。
+    单轮提问的上下文哈希为 0。
+    """
+    lines = [_message_text(m) for m in messages]
+    if any(line is None for line in lines):
+        return None
+    last_user = max((i for i, m in enumerate(messages) if m["role"] == "user"), default=None)
+    if last_user is None:
+        return None
+    system = [line for m, line in zip(messages, lines) if m["role"] == "system"]
+    history = [line for i, (m, line) in enumerate(zip(messages, lines)) if m["role"] != "system" and i != last_user]
+    context = 0
+    if history:
+        digest = hashlib.sha256("\n".join(history).encode("utf-8")).digest()
+        context = int.from_bytes(digest[:8], "big", signed=True) or 1
+    return context, "\n".join(system + [lines[last_user]])
+
+
+def cached_chat_completion(cache: SemanticCache, client: OpenAI, model: str, messages: list,
+                           temperature: float = None, max_tokens: int = None, threshold: float = None):
+    """
+    带语义缓存的 chat_completion，返回 (回答, 是否命中缓存)。
+
+    - temperature / max_tokens: 同 chat_completion，默认 None 即使用模型默认值
+    - Embedding 失败（如提示超出 Embedding 模型输入上限）时不使用缓存，直接请求模型
+    """
+    key = cache_key(messages)
+    if key is None:
+        return chat_completion(client, model, messages, temperature, max_tokens), False
+    context, text = key
+    try:
+        vec = cache.embed(client, text)
+    except Exception:
+        return chat_completion(client, model, messages, temperature, max_tokens), False
+    answer = cache.lookup(model, vec, context, threshold)
+    if answer is not None:
+        return answer, True
+    answer = chat_completion(client, model, messages, temperature, max_tokens)
+    cache.store(model, text, vec, answer, context)
+    return answer, False
@@ -0,0 +1,185 @@
+# 文件：utils/single_flight.py
+
+import asyncio
+import hashlib
+import json
+import threading
+
+
+def request_key(model: str, messages: list, **params) -> str:
+    """
+    由模型、消息列表和其余参数生成规范化哈希，参数顺序不同也得到同一个键。
+    """
+    payload = json.dumps(
+        {"model": model, "messages": messages, "params": params},
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.cancelled = False
+        self.waiters = 0
+        self.cond = threading.Condition()
+
+
+class SingleFlight:
+    """
+    线程版请求合并：同一个键同时只有一次上游调用，其余并发请求等待并共享它的结果。
+
+    上游调用在独立线程中执行，已产出的片段保存在内存里，后加入的等待者会先补读已有片段再继续跟随；
+    所有等待者都放弃后，上游流在下一个片段到来时被关闭。调用完成即从表中移除，不做结果缓存。
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def stream(self, key: str, producer):
+        """
+        生成器：共享 producer() 返回的可迭代对象的每个片段。
+
+        - producer: 无参函数，返回上游片段的可迭代对象；只有第一个到达的请求会调用它
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                threading.Thread(target=self._run, args=(key, flight, producer), daemon=True).start()
+            flight.waiters += 1
+        try:
+            read = 0
+            while True:
+                with flight.cond:
+                    while read >= len(flight.chunks) and not flight.done:
+                        flight.cond.wait()
+                    new = flight.chunks[read:]
+                    finished = flight.done
+                    error = flight.error
+                read += len(new)
+                for chunk in new:
+                    yield chunk
+                if finished and read >= len(flight.chunks):
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            with self._lock:
+                flight.waiters -= 1
+                if flight.waiters == 0 and not flight.done:
+                    flight.cancelled = True
+                    if self._flights.get(key) is flight:
+                        del self._flights[key]
+
+    def do(self, key: str, fn):
+        """
+        非流式版本：并发的相同请求只执行一次 fn()，并都返回它的结果。
+        """
+        flight = self.stream(key, lambda: (fn(),))
+        try:
+            return next(flight)
+        finally:
+            flight.close()
+
+    def _run(self, key: str, flight: _Flight, producer):
+        upstream = None
+        try:
+            upstream = producer()
+            for chunk in upstream:
+                if flight.cancelled:
+                    break
+                with flight.cond:
+                    flight.chunks.append(chunk)
+                    flight.cond.notify_all()
+        except Exception as exc:
+            flight.error = exc
+        finally:
+            if hasattr(upstream, "close"):
+                upstream.close()
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+
+class _AsyncFlight:
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.waiters = 0
+        self.changed = asyncio.Event()
+        self.task = None
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight 的 asyncio 版本，供 HTTP 服务使用；所有等待者都取消后，上游任务也随之取消。
+    """
+
+    def __init__(self):
+        self._flights = {}
+
+    async def stream(self, key: str, producer):
+        """
+        异步生成器，共享 producer() 返回的异步可迭代对象的每个片段。
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _AsyncFlight()
+            flight.task = asyncio.ensure_future(self._run(key, flight, producer))
+        flight.waiters += 1
+        try:
+            read = 0
+            while True:
+                while read >= len(flight.chunks) and not flight.done:
+                    flight.changed.clear()
+                    await flight.changed.wait()
+                new = flight.chunks[read:]
+                read += len(new)
+                for chunk in new:
+                    yield chunk
+                if flight.done and read >= len(flight.chunks):
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.done:
+                flight.task.cancel()
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+    async def do(self, key: str, fn):
+        """
+        非流式版本：fn 为返回协程的无参函数。
+        """
+        async def single():
+            yield await fn()
+
+        flight = self.stream(key, single)
+        try:
+            return await flight.__anext__()
+        finally:
+            await flight.aclose()
+
+    async def _run(self, key: str, flight: _AsyncFlight, producer):
+        try:
+            async for chunk in producer():
+                flight.chunks.append(chunk)
+                flight.changed.set()
+        except asyncio.CancelledError:
+            pass
+        except Exception as exc:
+            flight.error = exc
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.done = True
+            flight.changed.set()